@@ -1,8 +1,8 @@
 import streamlit as st
 import time
 from db import (
-    get_chat_requests, mark_notifications_read_by_request,
-    add_chat_request, get_patient, get_doctor
+    get_chat_request, mark_notifications_read_by_request,
+    add_chat_request, get_patient, get_doctor, release_connections
 )
 from ui import (
     show_login_page, show_patient_portal,
@@ -24,7 +24,7 @@ def main():
             req_id = int(query_params['req_id'])
             if st.session_state.logged_in:
                 user = st.session_state.user_profile
-                req = next((r for r in get_chat_requests() if r['request_id'] == req_id), None)
+                req = get_chat_request(req_id)
                 if req and req['status'] != 'Closed':
                     if req['patient_email'] == user.get('email') or req['doctor_email'] == user.get('email'):
                         st.session_state.active_chat_request = req_id
@@ -53,7 +53,6 @@ def main():
 
             if patient and doctor:
                 new_req = {
-                    "request_id": st.session_state.next_request_id,
                     "patient_email": p_email,
                     "doctor_email": d_email,
                     "specialty": doctor['specialty'],
@@ -67,10 +66,9 @@ def main():
                     "flag": "N",
                     "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
                 }
-                add_chat_request(new_req)
-                st.session_state.next_request_id += 1
+                rid = add_chat_request(new_req)
                 st.query_params.clear()
-                st.success(f"Chat #{new_req['request_id']} created.")
+                st.success(f"Chat #{rid} created.")
                 st.rerun()
             else:
                 st.error("Invalid patient or doctor.")
@@ -109,4 +107,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        release_connections()
\ No newline at end of file
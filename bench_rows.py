@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: per-row dicts vs. records.py slot records.
+
+Builds an in-memory chat_requests / chat_messages table, fetches the
+rows once, then times and measures (tracemalloc) turning them into the
+old zip-dict shape vs. the Record classes db.py now returns.
+
+    python bench_rows.py [rows]
+"""
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from records import ChatRequest, ChatMessage
+
+CHAT_REQUEST_KEYS = list(ChatRequest._fields)
+
+
+def make_db(n):
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f"CREATE TABLE chat_requests ({', '.join(CHAT_REQUEST_KEYS)})")
+    conn.executemany(
+        f"INSERT INTO chat_requests VALUES ({','.join('?' * len(CHAT_REQUEST_KEYS))})",
+        ((i, f"p{i}@x.com", "doc@x.com", "Cardiology", "Dr. A", "D1", "MBBS", "chest pain " * 4,
+          "Pending", f"Patient {i}", f"P{i:06d}", "N", "2026-01-01 10:00:00", None, None) for i in range(n)))
+    conn.execute("CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, sender, role, text, timestamp)")
+    conn.executemany("INSERT INTO chat_messages (sender, role, text, timestamp) VALUES (?,?,?,?)",
+                     ((f"User {i % 2}", "patient", f"message number {i}", "10:00") for i in range(n)))
+    return conn
+
+
+def measure(label, build, rows, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = build(rows)
+        best = min(best, time.perf_counter() - start)
+        del result
+    tracemalloc.start()
+    result = build(rows)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    print(f"  {label:<8} {best * 1000:8.1f} ms   {current / 2**20:8.1f} MiB")
+    return best, current
+
+
+def compare(title, rows, as_dicts, as_records):
+    print(f"{title} ({len(rows):,} rows)")
+    t_dict, m_dict = measure("dict", as_dicts, rows)
+    t_rec, m_rec = measure("record", as_records, rows)
+    print(f"  -> {t_dict / t_rec:.2f}x faster, {m_dict / m_rec:.2f}x less memory\n")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    conn = make_db(n)
+    requests = conn.execute("SELECT * FROM chat_requests").fetchall()
+    messages = conn.execute("SELECT * FROM chat_messages").fetchall()
+
+    compare("chat_requests", requests,
+            lambda rows: [{k: v for k, v in zip(CHAT_REQUEST_KEYS, r)} for r in rows],
+            lambda rows: list(map(ChatRequest._make, rows)))
+    compare("chat_messages", messages,
+            lambda rows: [{"id": r[0], "sender": r[1], "role": r[2], "text": r[3], "timestamp": r[4]} for r in rows],
+            lambda rows: list(map(ChatMessage._make, rows)))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,26 @@ import random
 import streamlit as st
 import smtplib
 import json
+import zlib
+import re
+from functools import lru_cache
+import atexit
+import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
+import queue
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
+from events import bus, chat_topic, user_topic
+from records import (
+    ChatRequest, ChatMessage, ChatAttachment, Notification, Prescription,
+    Submission, Feedback, DoctorSummary, PatientSummary, TimelineItem,
+    SearchHit, SubmissionHit, TriageResult
+)
+
 def load_env():
     env_path = Path('.env')
     if env_path.exists():
@@ -22,15 +37,135 @@ def load_env():
 
 load_env()
 
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# CONNECTION POOL
+# ----------------------------------------------------------------------
+# One pool per database file, shared by every session in the process.
+# A script-run thread checks a connection out on first use and keeps it
+# until release_connections() is called (or the thread exits), so the
+# cursor/commit helpers below always see the same connection.
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))      # waiting for a free pooled connection
+BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))       # waiting for another writer's lock
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class _Lease:
+    """A connection checked out by one thread; returned to the pool on release or GC."""
+
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+
+    def release(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.pool.put(conn)
+
+    def __del__(self):
+        self.release()
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=BUSY_TIMEOUT,
+                               cached_statements=256)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"connection pool for {self.path} exhausted ({self.size} in use)")
+
+    def put(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def connection(self):
+        """Return the connection checked out by the calling thread, borrowing one if needed."""
+        lease = getattr(self._local, 'lease', None)
+        if lease is None or lease.conn is None:
+            lease = _Lease(self, self.get())
+            self._local.lease = lease
+        return lease.conn
+
+    def release(self):
+        """Give the calling thread's connection back to the pool."""
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            lease.release()
+            self._local.lease = None
+
+    @contextmanager
+    def borrow(self):
+        """Check out a connection for the duration of a ``with`` block."""
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+
+patients_pool = ConnectionPool('patients.db')
+doctors_pool = ConnectionPool('doctors.db')
+
+
 def get_patients_conn():
-    if 'patients_conn' not in st.session_state:
-        st.session_state.patients_conn = sqlite3.connect('patients.db', check_same_thread=False)
-    return st.session_state.patients_conn
+    return patients_pool.connection()
 
 def get_doctors_conn():
-    if 'doctors_conn' not in st.session_state:
-        st.session_state.doctors_conn = sqlite3.connect('doctors.db', check_same_thread=False)
-    return st.session_state.doctors_conn
+    return doctors_pool.connection()
+
+def release_connections():
+    """Return this thread's connections to the pools; call at the end of every script run."""
+    patients_pool.release()
+    doctors_pool.release()
 
 def get_patients_cursor(): return get_patients_conn().cursor()
 def get_doctors_cursor():  return get_doctors_conn().cursor()
@@ -38,6 +173,43 @@ def get_doctors_cursor():  return get_doctors_conn().cursor()
 def commit_patients(): get_patients_conn().commit()
 def commit_doctors():  get_doctors_conn().commit()
 
+_tx_depth = threading.local()
+
+@contextmanager
+def transaction(conn):
+    """
+    Run a block as one transaction on `conn` and yield a cursor.
+    Commits on success, rolls back on error. A block nested inside another
+    transaction() on the same connection joins it instead of committing early.
+    """
+    depths = _tx_depth.__dict__.setdefault('depths', {})
+    key = id(conn)
+    if depths.get(key):
+        depths[key] += 1
+        try:
+            yield conn.cursor()
+        finally:
+            depths[key] -= 1
+        return
+    if conn.in_transaction:
+        # Left open by a statement outside transaction() that failed before
+        # its commit; it is not ours to join.
+        logger.warning("Rolling back a stray open transaction on %r", conn)
+        conn.rollback()
+    conn.execute('BEGIN IMMEDIATE')
+    depths[key] = 1
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        del depths[key]
+
+def patients_transaction(): return transaction(get_patients_conn())
+def doctors_transaction():  return transaction(get_doctors_conn())
+
 def init_databases():
     pc = get_patients_cursor()
     pc.execute('''
@@ -156,9 +328,201 @@ def init_databases():
 
     commit_doctors()
 
-if 'db_initialized' not in st.session_state:
-    init_databases()
-    st.session_state.db_initialized = True
+    run_migrations(get_patients_conn(), PATIENTS_MIGRATIONS)
+    run_migrations(get_doctors_conn(), DOCTORS_MIGRATIONS)
+
+# ----------------------------------------------------------------------
+# SCHEMA MIGRATIONS
+# ----------------------------------------------------------------------
+# Each entry is one schema version; PRAGMA user_version records how many
+# have been applied to a database file. Append new versions, never edit
+# ones that have shipped.
+
+def fts_migration(table, key, column):
+    """
+    Statements for an external-content FTS5 index <table>_fts over one text
+    column, kept in sync by triggers and filled from the existing rows.
+    """
+    fts = f'{table}_fts'
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column}, content='{table}', content_rowid='{key}', tokenize='porter unicode61')",
+        f'''CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+               INSERT INTO {fts}(rowid, {column}) VALUES (new.{key}, new.{column});
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+               INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{key}, old.{column});
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+               INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{key}, old.{column});
+               INSERT INTO {fts}(rowid, {column}) VALUES (new.{key}, new.{column});
+           END''',
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    )
+
+PATIENTS_MIGRATIONS = [
+    # 1: secondary indexes
+    (
+        'CREATE INDEX IF NOT EXISTS idx_submissions_patient ON submissions(patient_email, id)',
+    ),
+    # 2: full-text search over symptoms
+    fts_migration('submissions', 'id', 'symptoms'),
+    # 3: persistent tier of the triage result cache (see triage.py)
+    (
+        '''CREATE TABLE IF NOT EXISTS triage_cache (
+               cache_key TEXT PRIMARY KEY,
+               prompt_version TEXT NOT NULL,
+               specialty TEXT,
+               urgency TEXT,
+               recommendation TEXT,
+               emergency_advice TEXT,
+               created_at REAL NOT NULL,
+               used_at REAL NOT NULL
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_triage_cache_used ON triage_cache(used_at)',
+    ),
+    # 4: urgency and origin of each triage, for training the local model
+    (
+        'ALTER TABLE submissions ADD COLUMN urgency TEXT',
+        'ALTER TABLE submissions ADD COLUMN triage_source TEXT',
+    ),
+]
+
+DOCTORS_MIGRATIONS = [
+    # 1: secondary indexes
+    (
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_request ON chat_messages(request_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_attachments_request ON chat_attachments(request_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_email, status, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_request ON notifications(request_id, user_email)',
+        'CREATE INDEX IF NOT EXISTS idx_prescriptions_patient ON prescriptions(patient_email, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_requests_doctor ON chat_requests(doctor_email, status, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_requests_patient ON chat_requests(patient_email, timestamp)',
+    ),
+    # 2: unfiltered request listing in timestamp order
+    (
+        'CREATE INDEX IF NOT EXISTS idx_chat_requests_timestamp ON chat_requests(timestamp)',
+    ),
+    # 3: newest-first notification panel without sorting the whole history
+    (
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user_time ON notifications(user_email, timestamp)',
+    ),
+    # 4: full-resolution send times for the merged chat timeline. Older rows
+    # only kept HH:MM, so they are dated from their chat request.
+    (
+        'ALTER TABLE chat_messages ADD COLUMN ts REAL',
+        'ALTER TABLE chat_attachments ADD COLUMN ts REAL',
+        '''UPDATE chat_messages SET ts = (
+               SELECT (julianday(substr(r.timestamp, 1, 10) || ' ' || chat_messages.timestamp, 'utc') - 2440587.5) * 86400.0
+               FROM chat_requests r WHERE r.request_id = chat_messages.request_id)''',
+        '''UPDATE chat_attachments SET ts = (
+               SELECT (julianday(substr(r.timestamp, 1, 10) || ' ' || chat_attachments.timestamp, 'utc') - 2440587.5) * 86400.0
+               FROM chat_requests r WHERE r.request_id = chat_attachments.request_id)''',
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_request_ts ON chat_messages(request_id, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_attachments_request_ts ON chat_attachments(request_id, ts)',
+    ),
+    # 5: closing/archival times for the cold archive; existing closed chats
+    # count as closed at their last message.
+    (
+        'ALTER TABLE chat_requests ADD COLUMN closed_at TEXT',
+        'ALTER TABLE chat_requests ADD COLUMN archived_at TEXT',
+        '''UPDATE chat_requests SET closed_at = COALESCE(
+               (SELECT datetime(MAX(ts), 'unixepoch', 'localtime') FROM chat_messages m
+                WHERE m.request_id = chat_requests.request_id),
+               timestamp)
+           WHERE status = 'Closed'
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_chat_requests_closed ON chat_requests(status, closed_at)',
+    ),
+    # 6: content-addressed attachments (see storage.py)
+    (
+        'ALTER TABLE chat_attachments ADD COLUMN sha256 TEXT',
+        'ALTER TABLE chat_attachments ADD COLUMN size INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_chat_attachments_sha256 ON chat_attachments(sha256)',
+    ),
+    # 7: full-text search over consultations
+    fts_migration('chat_messages', 'id', 'text')
+    + fts_migration('chat_requests', 'request_id', 'query')
+    + fts_migration('prescriptions', 'id', 'advice'),
+]
+
+def run_migrations(conn, migrations):
+    """Bring a database up to len(migrations), one transaction per version."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target, statements in enumerate(migrations[version:], start=version + 1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return max(version, len(migrations))
+
+# ----------------------------------------------------------------------
+# ONE-TIME STARTUP
+# ----------------------------------------------------------------------
+# Schema creation, migrations and admin seeding run once per process when
+# db.py is first imported, never per session or per rerun. The file lock
+# keeps several server processes from bootstrapping the same files at once.
+
+BOOTSTRAP_LOCK_FILE = '.db_bootstrap.lock'
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = False
+
+@contextmanager
+def file_lock(path):
+    with open(path, 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def seed_admin():
+    c = get_doctors_cursor()
+    c.execute('SELECT COUNT(*) FROM doctors WHERE email = ?', ('admin@app.com',))
+    if c.fetchone()[0] == 0:
+        add_doctor(
+            email="admin@app.com",
+            password="admin",
+            name="System Admin",
+            mobile="0000000000",
+            specialty="Admin",
+            doc_id="000",
+            qualification="System"
+        )
+
+def bootstrap():
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        with file_lock(BOOTSTRAP_LOCK_FILE):
+            try:
+                init_databases()
+                init_archive()
+                seed_admin()
+            finally:
+                release_connections()
+        start_archiver()
+        _bootstrapped = True
 
 def hash_password(pw: str) -> str:
     return bcrypt.hashpw(pw.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -168,11 +532,10 @@ def check_password(pw: str, hashed: str) -> bool:
 
 def register_patient(email, password, name, mobile):
     pid = "P" + (mobile[-6:] if mobile and len(mobile) >= 6 else f"{random.randint(100000,999999)}")
-    c = get_patients_cursor()
     try:
-        c.execute('INSERT INTO patients (email, password, name, mobile, patient_id) VALUES (?, ?, ?, ?, ?)',
-                  (email, hash_password(password), name, mobile, pid))
-        commit_patients()
+        with patients_transaction() as c:
+            c.execute('INSERT INTO patients (email, password, name, mobile, patient_id) VALUES (?, ?, ?, ?, ?)',
+                      (email, hash_password(password), name, mobile, pid))
         return True
     except sqlite3.IntegrityError:
         return False
@@ -186,13 +549,12 @@ def get_patient(email):
     return None
 
 def add_doctor(email, password, name, mobile, specialty, doc_id, qualification):
-    c = get_doctors_cursor()
     try:
-        c.execute('''
-            INSERT INTO doctors (email, password, name, mobile, specialty, doc_id, qualification)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (email, hash_password(password), name, mobile, specialty, doc_id, qualification))
-        commit_doctors()
+        with doctors_transaction() as c:
+            c.execute('''
+                INSERT INTO doctors (email, password, name, mobile, specialty, doc_id, qualification)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (email, hash_password(password), name, mobile, specialty, doc_id, qualification))
         return True
     except sqlite3.IntegrityError:
         return False
@@ -212,25 +574,16 @@ def get_doctor(email):
 def get_all_doctors():
     c = get_doctors_cursor()
     c.execute('SELECT email, name, mobile, specialty, doc_id, qualification FROM doctors')
-    return [{"email":r[0],"name":r[1],"mobile":r[2],"specialty":r[3],"doc_id":r[4],"qualification":r[5],"role":"doctor"} for r in c.fetchall()]
+    return list(map(DoctorSummary._make, c.fetchall()))
 
 def get_all_patients():
     """
     Retrieves all registered patients from the patients database.
-    Returns a list of dictionaries with patient details.
+    Returns a list of dict-compatible PatientSummary records.
     """
     c = get_patients_cursor()
     c.execute('SELECT email, name, mobile, patient_id FROM patients ORDER BY name')
-    rows = c.fetchall()
-    patients = []
-    for row in rows:
-        patients.append({
-            "email": row[0],
-            "name": row[1],
-            "mobile": row[2],
-            "patient_id": row[3]
-        })
-    return patients
+    return list(map(PatientSummary._make, c.fetchall()))
 
 def save_otp(email, otp):
     c = get_patients_cursor()
@@ -289,91 +642,336 @@ def send_verification_email(email, otp):
         st.error(f"Email failed: {e}")
         return False
 
-def get_chat_requests():
+CHAT_REQUEST_COLUMNS = ', '.join(ChatRequest._fields)
+
+def get_chat_requests(doctor_email=None, patient_email=None, status=None, since=None, limit=None, before=None):
+    """
+    Chat requests, newest first, filtered in SQL.
+    `before` is a keyset cursor: the (timestamp, request_id) of the last row
+    of the previous page; see chat_request_cursor().
+    """
+    clauses, params = [], []
+    if doctor_email is not None:
+        clauses.append('doctor_email = ?')
+        params.append(doctor_email)
+    if patient_email is not None:
+        clauses.append('patient_email = ?')
+        params.append(patient_email)
+    if status is not None:
+        clauses.append('status = ?')
+        params.append(status)
+    if since is not None:
+        clauses.append('timestamp >= ?')
+        params.append(since)
+    if before is not None:
+        clauses.append('(timestamp, request_id) < (?, ?)')
+        params.extend(before)
+    sql = f'SELECT {CHAT_REQUEST_COLUMNS} FROM chat_requests'
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY timestamp DESC, request_id DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
     c = get_doctors_cursor()
-    c.execute('SELECT * FROM chat_requests ORDER BY timestamp DESC')
-    return [{k:v for k,v in zip([
-        "request_id","patient_email","doctor_email","specialty","doctor_name","doctor_id",
-        "qualification","query","status","patient_name","patient_id","flag","timestamp"
-    ], r)} for r in c.fetchall()]
+    c.execute(sql, params)
+    return list(map(ChatRequest._make, c.fetchall()))
 
-def add_chat_request(req):
+def chat_request_cursor(req):
+    return (req['timestamp'], req['request_id'])
+
+def get_chat_request(rid):
     c = get_doctors_cursor()
-    c.execute('INSERT INTO chat_requests VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', (
-        req['request_id'], req['patient_email'], req['doctor_email'], req['specialty'],
-        req['doctor_name'], req['doctor_id'], req['qualification'], req['query'],
-        req['status'], req['patient_name'], req['patient_id'], req['flag'], req['timestamp']
-    ))
-    commit_doctors()
-    add_notification(req['doctor_email'], f"New request from {req['patient_name']} (ID: {req['request_id']})", req['request_id'])
+    c.execute(f'SELECT {CHAT_REQUEST_COLUMNS} FROM chat_requests WHERE request_id = ?', (rid,))
+    row = c.fetchone()
+    return ChatRequest._make(row) if row else None
+
+FIRST_REQUEST_ID = 10001
+
+def add_chat_request(req):
+    """
+    Insert a chat request and return its new request_id.
+    The ID is allocated inside the insert's write transaction, so
+    concurrent sessions can never be handed the same one.
+    """
+    with doctors_transaction() as c:
+        c.execute('''
+            INSERT INTO chat_requests (
+                request_id, patient_email, doctor_email, specialty, doctor_name, doctor_id,
+                qualification, query, status, patient_name, patient_id, flag, timestamp
+            ) VALUES (
+                (SELECT COALESCE(MAX(request_id) + 1, ?) FROM chat_requests),
+                ?,?,?,?,?,?,?,?,?,?,?,?
+            )
+        ''', (
+            FIRST_REQUEST_ID, req['patient_email'], req['doctor_email'], req['specialty'],
+            req['doctor_name'], req['doctor_id'], req['qualification'], req['query'],
+            req['status'], req['patient_name'], req['patient_id'], req['flag'], req['timestamp']
+        ))
+        rid = c.lastrowid
+    add_notification(req['doctor_email'], f"New request from {req['patient_name']} (ID: {rid})", rid)
+    return rid
 
 def update_chat_request_status(rid, status):
-    c = get_doctors_cursor()
-    c.execute('SELECT patient_email, doctor_name FROM chat_requests WHERE request_id = ?', (rid,))
-    res = c.fetchone()
+    with doctors_transaction() as c:
+        c.execute('SELECT patient_email, doctor_name FROM chat_requests WHERE request_id = ?', (rid,))
+        res = c.fetchone()
+        if res:
+            c.execute('''
+                UPDATE chat_requests
+                SET status = ?, closed_at = CASE WHEN ? = 'Closed' THEN ? ELSE closed_at END
+                WHERE request_id = ?
+            ''', (status, status, time.strftime("%Y-%m-%d %H:%M:%S"), rid))
     if res:
+        bus.publish(chat_topic(rid))
         p_email, d_name = res
-        c.execute('UPDATE chat_requests SET status = ? WHERE request_id = ?', (status, rid))
-        commit_doctors()
         if status == "Accepted":
             add_notification(p_email, f"Dr. {d_name} accepted (ID: {rid})", rid)
         elif status == "Closed":
             add_notification(p_email, f"Chat closed (ID: {rid})", rid)
 
-def get_chat_messages(rid):
+# ----------------------------------------------------------------------
+# CHANGE EVENTS
+# ----------------------------------------------------------------------
+# Writers publish to the in-process event bus after they commit. Readers
+# compare a topic's version with the one they last rendered and skip the
+# database entirely when nothing moved.
+
+def chat_version(rid):
+    return bus.version(chat_topic(rid))
+
+def notifications_version(email):
+    return bus.version(user_topic(email))
+
+def get_chat_messages(rid, after_id=0):
+    """Messages of a chat in send order; pass the last id you have as `after_id` to fetch only newer ones."""
     c = get_doctors_cursor()
-    c.execute('SELECT sender, role, text, timestamp FROM chat_messages WHERE request_id = ? ORDER BY id', (rid,))
-    return [{"sender":r[0],"role":r[1],"text":r[2],"timestamp":r[3]} for r in c.fetchall()]
+    c.execute('SELECT id, sender, role, text, timestamp FROM chat_messages WHERE request_id = ? AND id > ? ORDER BY id',
+              (rid, after_id))
+    return list(map(ChatMessage._make, c.fetchall()))
 
 def add_chat_message(rid, sender, role, text):
-    ts = time.strftime("%H:%M")
-    c = get_doctors_cursor()
-    c.execute('INSERT INTO chat_messages (request_id, sender, role, text, timestamp) VALUES (?,?,?,?,?)',
-              (rid, sender, role, text, ts))
-    commit_doctors()
-    c.execute('SELECT patient_email, doctor_email FROM chat_requests WHERE request_id = ?', (rid,))
-    p, d = c.fetchone()
+    with doctors_transaction() as c:
+        # Stamped after BEGIN IMMEDIATE, so ts order matches commit order.
+        ts = time.time()
+        c.execute('INSERT INTO chat_messages (request_id, sender, role, text, timestamp, ts) VALUES (?,?,?,?,?,?)',
+                  (rid, sender, role, text, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)), ts))
+        c.execute('SELECT patient_email, doctor_email FROM chat_requests WHERE request_id = ?', (rid,))
+        p, d = c.fetchone()
+    bus.publish(chat_topic(rid))
     recipient = d if role == "patient" else p
     add_notification(recipient, f"New message from {sender}", rid)
 
 # File attachment functions
-def add_chat_attachment(request_id, filename, file_path, sender, role):
-    ts = time.strftime("%H:%M")
-    c = get_doctors_cursor()
-    c.execute('''
-        INSERT INTO chat_attachments 
-        (request_id, filename, file_path, sender, role, timestamp) 
-        VALUES (?,?,?,?,?,?)
-    ''', (request_id, filename, file_path, sender, role, ts))
-    commit_doctors()
+def add_chat_attachment(request_id, filename, file_path, sender, role, sha256=None, size=None):
+    with doctors_transaction() as c:
+        ts = time.time()
+        c.execute('''
+            INSERT INTO chat_attachments 
+            (request_id, filename, file_path, sender, role, timestamp, ts, sha256, size) 
+            VALUES (?,?,?,?,?,?,?,?,?)
+        ''', (request_id, filename, file_path, sender, role, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)), ts,
+              sha256, size))
 
-    c.execute('SELECT patient_email, doctor_email FROM chat_requests WHERE request_id = ?', (request_id,))
-    p, d = c.fetchone()
+        c.execute('SELECT patient_email, doctor_email FROM chat_requests WHERE request_id = ?', (request_id,))
+        p, d = c.fetchone()
+    bus.publish(chat_topic(request_id))
     recipient = d if role == "patient" else p
     add_notification(recipient, f"New file from {sender}: {filename}", request_id)
 
-def get_chat_attachments(request_id):
+def get_chat_attachments(request_id, after_id=0):
     c = get_doctors_cursor()
     c.execute('''
-        SELECT sender, role, filename, file_path, timestamp 
+        SELECT id, sender, role, filename, file_path, timestamp 
         FROM chat_attachments 
-        WHERE request_id = ? 
+        WHERE request_id = ? AND id > ?
         ORDER BY id
-    ''', (request_id,))
-    return [{"sender":r[0], "role":r[1], "filename":r[2], "file_path":r[3], "timestamp":r[4]} for r in c.fetchall()]
+    ''', (request_id, after_id))
+    return list(map(ChatAttachment._make, c.fetchall()))
+
+_TIMELINE_MEMBER = '''
+    SELECT * FROM (
+        SELECT '{kind}' AS kind, id, sender, role, {text} AS text, {filename} AS filename,
+               {file_path} AS file_path, ts, timestamp
+        FROM {table}
+        WHERE request_id = ?{where}
+        ORDER BY ts {order}, id {order}
+        {limit}
+    )
+'''
+
+def get_chat_timeline(request_id, limit=None, before=None, after=None):
+    """
+    Messages and attachments of a chat merged into one list, oldest first.
+    With `limit`, returns the newest `limit` items (older than the `before`
+    cursor, if given); `after` returns only items newer than that cursor.
+    Cursors are (ts, kind, id) tuples; see timeline_cursor().
+    """
+    where, params = "", []
+    if before is not None:
+        where += " AND ts <= ? AND (ts, '{kind}', id) < (?, ?, ?)"
+        params += [before[0], *before]
+    if after is not None:
+        where += " AND ts >= ? AND (ts, '{kind}', id) > (?, ?, ?)"
+        params += [after[0], *after]
+    newest_first = limit is not None
+    order = "DESC" if newest_first else "ASC"
+    members = []
+    for kind, table, text, filename, file_path in (
+        ("attachment", "chat_attachments", "NULL", "filename", "file_path"),
+        ("message", "chat_messages", "text", "NULL", "NULL"),
+    ):
+        members.append(_TIMELINE_MEMBER.format(
+            kind=kind, table=table, text=text, filename=filename, file_path=file_path,
+            where=where.format(kind=kind), order=order, limit="LIMIT ?" if newest_first else ""))
+    sql = " UNION ALL ".join(members) + f" ORDER BY ts {order}, kind {order}, id {order}"
+    member_params = [request_id, *params] + ([limit] if newest_first else [])
+    all_params = member_params * 2
+    if newest_first:
+        sql += " LIMIT ?"
+        all_params.append(limit)
+    c = get_doctors_cursor()
+    c.execute(sql, all_params)
+    items = list(map(TimelineItem._make, c.fetchall()))
+    if newest_first:
+        items.reverse()
+    if not items and is_chat_archived(request_id):
+        return _filter_timeline(get_archived_timeline(request_id), limit, before, after)
+    return items
+
+def timeline_cursor(item):
+    return (item['ts'], item['kind'], item['id'])
+
+def _filter_timeline(items, limit=None, before=None, after=None):
+    key = lambda i: (i['ts'] or 0, i['kind'], i['id'])
+    if before is not None:
+        items = [i for i in items if key(i) < tuple(before)]
+    if after is not None:
+        items = [i for i in items if key(i) > tuple(after)]
+    if limit is not None:
+        items = items[-limit:] if limit else []
+    return list(items)
+
+# ----------------------------------------------------------------------
+# COLD ARCHIVE
+# ----------------------------------------------------------------------
+# Chats closed for longer than ARCHIVE_AFTER_DAYS have their messages,
+# attachment rows and notifications moved out of doctors.db into one
+# zlib-compressed JSON blob per chat in archive.db. The chat_requests row
+# stays (with archived_at set), and get_chat_timeline() falls back to the
+# archive, so old transcripts still open as before.
+
+ARCHIVE_PATH = os.getenv("ARCHIVE_DB", "archive.db")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "6"))
+ARCHIVE_LOCK_FILE = '.db_archive.lock'
+
+archive_pool = ConnectionPool(ARCHIVE_PATH, size=2)
+
+def init_archive():
+    with archive_pool.borrow() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat_archive (
+                request_id INTEGER PRIMARY KEY,
+                closed_at TEXT,
+                archived_at TEXT NOT NULL,
+                transcript BLOB NOT NULL  -- zlib-compressed JSON
+            )
+        ''')
+        conn.commit()
+
+def is_chat_archived(rid):
+    c = get_doctors_cursor()
+    c.execute('SELECT archived_at FROM chat_requests WHERE request_id = ?', (rid,))
+    row = c.fetchone()
+    return bool(row and row[0])
+
+@lru_cache(maxsize=32)
+def _load_archived_transcript(rid):
+    with archive_pool.borrow() as conn:
+        row = conn.execute('SELECT transcript FROM chat_archive WHERE request_id = ?', (rid,)).fetchone()
+    return json.loads(zlib.decompress(row[0])) if row else None
+
+def get_archived_timeline(rid):
+    transcript = _load_archived_transcript(int(rid))
+    if not transcript:
+        return []
+    items = [TimelineItem._make(("message", m["id"], m["sender"], m["role"], m["text"], None, None,
+                                 m["ts"], m["timestamp"])) for m in transcript["messages"]]
+    items += [TimelineItem._make(("attachment", a["id"], a["sender"], a["role"], None, a["filename"],
+                                  a["file_path"], a["ts"], a["timestamp"])) for a in transcript["attachments"]]
+    items.sort(key=lambda i: (i['ts'] or 0, i['kind'], i['id']))
+    return items
+
+def _rows_as_dicts(cursor):
+    names = [d[0] for d in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def archive_closed_chats(max_age_days=ARCHIVE_AFTER_DAYS, batch_size=100):
+    """Move closed chats older than `max_age_days` into the archive; returns how many were moved."""
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - max_age_days * 86400))
+    moved = 0
+    touched_users = set()
+    with doctors_pool.borrow() as hot, archive_pool.borrow() as cold:
+        candidates = hot.execute('''
+            SELECT request_id, closed_at FROM chat_requests
+            WHERE status = 'Closed' AND closed_at < ? AND archived_at IS NULL
+            ORDER BY closed_at LIMIT ?
+        ''', (cutoff, batch_size)).fetchall()
+        for rid, closed_at in candidates:
+            # Hold the hot write lock from read to delete so nothing slips in between.
+            with transaction(hot) as h:
+                transcript = {
+                    "messages": _rows_as_dicts(h.execute(
+                        'SELECT id, sender, role, text, timestamp, ts FROM chat_messages WHERE request_id = ? ORDER BY id',
+                        (rid,))),
+                    "attachments": _rows_as_dicts(h.execute(
+                        'SELECT id, sender, role, filename, file_path, timestamp, ts FROM chat_attachments WHERE request_id = ? ORDER BY id',
+                        (rid,))),
+                    "notifications": _rows_as_dicts(h.execute(
+                        'SELECT id, user_email, message, status, timestamp FROM notifications WHERE request_id = ? ORDER BY id',
+                        (rid,))),
+                }
+                now = time.strftime("%Y-%m-%d %H:%M:%S")
+                # Written (and committed) before the hot delete, so a crash in
+                # between leaves both copies and the next run just redoes it.
+                with transaction(cold) as a:
+                    a.execute('INSERT OR REPLACE INTO chat_archive VALUES (?, ?, ?, ?)',
+                              (rid, closed_at, now, zlib.compress(json.dumps(transcript).encode('utf-8'), 9)))
+                h.execute('DELETE FROM chat_messages WHERE request_id = ?', (rid,))
+                h.execute('DELETE FROM chat_attachments WHERE request_id = ?', (rid,))
+                h.execute('DELETE FROM notifications WHERE request_id = ?', (rid,))
+                h.execute('UPDATE chat_requests SET archived_at = ? WHERE request_id = ?', (now, rid))
+            touched_users.update(n["user_email"] for n in transcript["notifications"])
+            moved += 1
+    if touched_users:
+        bus.publish(*(user_topic(email) for email in touched_users))
+    return moved
+
+def _archiver_loop():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+        try:
+            with file_lock(ARCHIVE_LOCK_FILE):
+                while archive_closed_chats() > 0:
+                    pass
+        except Exception:
+            logger.exception("Chat archival run failed")
+
+def start_archiver():
+    if ARCHIVE_AFTER_DAYS > 0 and ARCHIVE_INTERVAL_HOURS > 0:
+        threading.Thread(target=_archiver_loop, name="chat-archiver", daemon=True).start()
 
 # Prescription functions
 def add_prescription(request_id, patient_email, doctor_email, doctor_name, patient_name, medicines, advice=""):
     ts = time.strftime("%Y-%m-%d %H:%M:%S")
     medicines_json = json.dumps(medicines)
-    c = get_doctors_cursor()
-    c.execute('''
-        INSERT INTO prescriptions 
-        (request_id, patient_email, doctor_email, doctor_name, patient_name, medicines, advice, timestamp)
-        VALUES (?,?,?,?,?,?,?,?)
-    ''', (request_id, patient_email, doctor_email, doctor_name, patient_name, medicines_json, advice, ts))
-    commit_doctors()
-
+    with doctors_transaction() as c:
+        c.execute('''
+            INSERT INTO prescriptions 
+            (request_id, patient_email, doctor_email, doctor_name, patient_name, medicines, advice, timestamp)
+            VALUES (?,?,?,?,?,?,?,?)
+        ''', (request_id, patient_email, doctor_email, doctor_name, patient_name, medicines_json, advice, ts))
     add_notification(patient_email, f"New prescription from Dr. {doctor_name} (Chat #{request_id})", request_id)
 
 def get_prescriptions_for_patient(patient_email):
@@ -384,33 +982,67 @@ def get_prescriptions_for_patient(patient_email):
         WHERE patient_email = ? 
         ORDER BY timestamp DESC
     ''', (patient_email,))
-    rows = c.fetchall()
-    prescriptions = []
-    for row in rows:
-        medicines = json.loads(row[3]) if row[3] else []
-        prescriptions.append({
-            "id": row[0],
-            "request_id": row[1],
-            "doctor_name": row[2],
-            "medicines": medicines,
-            "advice": row[4],
-            "timestamp": row[5]
-        })
-    return prescriptions
+    return [Prescription._make((pid, rid, d_name, json.loads(meds) if meds else [], advice, ts))
+            for pid, rid, d_name, meds, advice, ts in c.fetchall()]
 
 def add_submission(sub):
     c = get_patients_cursor()
-    c.execute('INSERT INTO submissions (date, symptoms, prediction, patient_email) VALUES (?,?,?,?)',
-              (sub['date'], sub['symptoms'], sub['prediction'], sub['patient_email']))
+    c.execute('''
+        INSERT INTO submissions (date, symptoms, prediction, patient_email, urgency, triage_source)
+        VALUES (?,?,?,?,?,?)
+    ''', (sub['date'], sub['symptoms'], sub['prediction'], sub['patient_email'], sub.get('urgency'),
+          sub.get('source')))
     commit_patients()
 
+def get_triage_training_rows(limit=50000):
+    """(symptoms, prediction, urgency) of the newest submissions answered by the LLM."""
+    c = get_patients_cursor()
+    c.execute('''
+        SELECT symptoms, prediction, urgency FROM submissions
+        WHERE (triage_source IS NULL OR triage_source = 'llm') AND symptoms IS NOT NULL
+        ORDER BY id DESC LIMIT ?
+    ''', (limit,))
+    return c.fetchall()
+
 def get_submissions(email=None):
     c = get_patients_cursor()
     if email:
-        c.execute('SELECT id, date, symptoms, prediction FROM submissions WHERE patient_email = ?', (email,))
+        c.execute('SELECT id, date, symptoms, prediction, patient_email FROM submissions WHERE patient_email = ?', (email,))
     else:
         c.execute('SELECT id, date, symptoms, prediction, patient_email FROM submissions')
-    return [{"id":r[0],"date":r[1],"symptoms":r[2],"prediction":r[3],"patient_email":r[4] if len(r)>4 else None} for r in c.fetchall()]
+    return list(map(Submission._make, c.fetchall()))
+
+def get_cached_triage(cache_key, max_age):
+    """The cached TriageResult for `cache_key` if younger than `max_age` seconds, else None."""
+    now = time.time()
+    c = get_patients_cursor()
+    c.execute('''
+        SELECT specialty, urgency, recommendation, emergency_advice FROM triage_cache
+        WHERE cache_key = ? AND created_at >= ?
+    ''', (cache_key, now - max_age))
+    row = c.fetchone()
+    if row is None:
+        return None
+    c.execute('UPDATE triage_cache SET used_at = ? WHERE cache_key = ?', (now, cache_key))
+    commit_patients()
+    return TriageResult._make(row)
+
+def put_cached_triage(cache_key, prompt_version, result, max_age, max_rows):
+    """
+    Store a TriageResult, then drop expired rows and the least recently used
+    ones beyond `max_rows`. Returns how many rows were evicted.
+    """
+    now = time.time()
+    with patients_transaction() as c:
+        c.execute('INSERT OR REPLACE INTO triage_cache VALUES (?,?,?,?,?,?,?,?)',
+                  (cache_key, prompt_version, *result.values(), now, now))
+        c.execute('DELETE FROM triage_cache WHERE created_at < ?', (now - max_age,))
+        evicted = c.rowcount
+        c.execute('''
+            DELETE FROM triage_cache WHERE cache_key IN (
+                SELECT cache_key FROM triage_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)
+        ''', (max_rows,))
+        return evicted + c.rowcount
 
 def add_feedback(fb):
     c = get_patients_cursor()
@@ -421,25 +1053,230 @@ def add_feedback(fb):
 def get_feedback():
     c = get_patients_cursor()
     c.execute('SELECT user_email, feedback, timestamp FROM feedback')
-    return [{"user_email":r[0],"feedback":r[1],"timestamp":r[2]} for r in c.fetchall()]
+    return list(map(Feedback._make, c.fetchall()))
 
-def add_notification(email, msg, rid=None):
+# ----------------------------------------------------------------------
+# FULL-TEXT SEARCH
+# ----------------------------------------------------------------------
+# Backed by the *_fts tables from the migrations above. Results are ranked
+# by bm25 (lower is better) and paged with limit/offset; each source is
+# asked for at most offset + limit + 1 hits before merging. Archived chats
+# leave the hot tables and so drop out of search.
+
+SNIPPET_TOKENS = 12
+
+# (query, column holding the doctor's email) per searchable source
+_CONSULTATION_SEARCHES = (
+    ('''
+        SELECT 'message', m.request_id,
+               snippet(chat_messages_fts, 0, '**', '**', '…', {tokens}), chat_messages_fts.rank,
+               datetime(m.ts, 'unixepoch', 'localtime'), r.patient_name, r.doctor_name
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        JOIN chat_requests r ON r.request_id = m.request_id
+        WHERE chat_messages_fts MATCH ? {where}
+        ORDER BY chat_messages_fts.rank LIMIT ?
+    ''', 'r.doctor_email'),
+    ('''
+        SELECT 'request', r.request_id,
+               snippet(chat_requests_fts, 0, '**', '**', '…', {tokens}), chat_requests_fts.rank,
+               r.timestamp, r.patient_name, r.doctor_name
+        FROM chat_requests_fts
+        JOIN chat_requests r ON r.request_id = chat_requests_fts.rowid
+        WHERE chat_requests_fts MATCH ? {where}
+        ORDER BY chat_requests_fts.rank LIMIT ?
+    ''', 'r.doctor_email'),
+    ('''
+        SELECT 'prescription', p.request_id,
+               snippet(prescriptions_fts, 0, '**', '**', '…', {tokens}), prescriptions_fts.rank,
+               p.timestamp, p.patient_name, p.doctor_name
+        FROM prescriptions_fts
+        JOIN prescriptions p ON p.id = prescriptions_fts.rowid
+        WHERE prescriptions_fts MATCH ? {where}
+        ORDER BY prescriptions_fts.rank LIMIT ?
+    ''', 'p.doctor_email'),
+)
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    return ' '.join(f'"{term}"*' for term in re.findall(r'\w+', text or ''))
+
+def search_consultations(text, doctor_email=None, limit=20, offset=0):
+    """
+    Search chat messages, request queries and prescription advice.
+    Returns (hits, has_more); hits are SearchHit records, best first.
+    """
+    match = fts_query(text)
+    if not match:
+        return [], False
     c = get_doctors_cursor()
-    c.execute('INSERT INTO notifications (user_email, message, timestamp, request_id) VALUES (?,?,?,?)',
-              (email, msg, time.strftime("%Y-%m-%d %H:%M:%S"), rid))
-    commit_doctors()
+    hits = []
+    for sql, doctor_column in _CONSULTATION_SEARCHES:
+        where, params = '', [match]
+        if doctor_email:
+            where, params = f'AND {doctor_column} = ?', params + [doctor_email]
+        c.execute(sql.format(tokens=SNIPPET_TOKENS, where=where), params + [offset + limit + 1])
+        hits.extend(c.fetchall())
+    hits.sort(key=lambda h: h[3])
+    return list(map(SearchHit._make, hits[offset:offset + limit])), len(hits) > offset + limit
+
+def search_submissions(text, patient_email=None, limit=20, offset=0):
+    """Search symptom submissions; returns (hits, has_more) like search_consultations."""
+    match = fts_query(text)
+    if not match:
+        return [], False
+    where, params = '', [match]
+    if patient_email:
+        where, params = 'AND s.patient_email = ?', params + [patient_email]
+    c = get_patients_cursor()
+    c.execute(f'''
+        SELECT s.id, s.date, snippet(submissions_fts, 0, '**', '**', '…', {SNIPPET_TOKENS}),
+               s.prediction, s.patient_email, submissions_fts.rank
+        FROM submissions_fts
+        JOIN submissions s ON s.id = submissions_fts.rowid
+        WHERE submissions_fts MATCH ? {where}
+        ORDER BY submissions_fts.rank LIMIT ? OFFSET ?
+    ''', params + [limit + 1, offset])
+    rows = c.fetchall()
+    return list(map(SubmissionHit._make, rows[:limit])), len(rows) > limit
+
+# ----------------------------------------------------------------------
+# NOTIFICATION WRITE-BEHIND QUEUE
+# ----------------------------------------------------------------------
+# add_notification() only enqueues; a single writer thread drains the
+# queue and inserts whole batches with executemany in one transaction.
+
+class NotificationWriter:
+    def __init__(self, pool, batch_size=500, linger=0.05):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.linger = linger
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def enqueue(self, email, msg, rid=None):
+        self._ensure_started()
+        row = (email, msg, time.strftime("%Y-%m-%d %H:%M:%S"), rid)
+        self._queue.put((time.monotonic(), row))
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="notification-writer", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self.pool.borrow() as conn:
+            with transaction(conn) as c:
+                c.executemany('INSERT INTO notifications (user_email, message, timestamp, request_id) VALUES (?,?,?,?)',
+                              [row for _, row in batch])
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                for attempt in range(3):
+                    try:
+                        self._write(batch)
+                        break
+                    except sqlite3.OperationalError:
+                        if attempt == 2:
+                            raise
+                        time.sleep(0.1 * (attempt + 1))
+                bus.publish(*{user_topic(row[0]) for _, row in batch})
+                latency = (time.monotonic() - batch[0][0]) * 1000
+                self.written += len(batch)
+                self.batches += 1
+                self.last_flush_ms = latency
+                self.max_flush_ms = max(self.max_flush_ms, latency)
+            except Exception:
+                self.failures += len(batch)
+                logger.exception("Dropped %d notifications", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until everything enqueued so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
 
-def get_notifications(email):
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+            "max_flush_ms": round(self.max_flush_ms, 1),
+        }
+
+
+notification_writer = NotificationWriter(doctors_pool)
+atexit.register(notification_writer.flush)
+
+def add_notification(email, msg, rid=None):
+    notification_writer.enqueue(email, msg, rid)
+
+def notification_queue_stats():
+    return notification_writer.stats()
+
+def get_notifications(email, limit=None, unread_only=False):
+    sql = 'SELECT id, message, status, timestamp, request_id FROM notifications WHERE user_email = ?'
+    params = [email]
+    if unread_only:
+        sql += " AND status = 'unread'"
+    sql += ' ORDER BY timestamp DESC, id DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
     c = get_doctors_cursor()
-    c.execute('SELECT id, message, status, timestamp, request_id FROM notifications WHERE user_email = ? ORDER BY timestamp DESC', (email,))
-    return [{"id":r[0],"message":r[1],"status":r[2],"timestamp":r[3],"request_id":r[4]} for r in c.fetchall()]
+    c.execute(sql, params)
+    return list(map(Notification._make, c.fetchall()))
 
 def mark_notification_read(nid):
     c = get_doctors_cursor()
+    c.execute('SELECT user_email FROM notifications WHERE id = ?', (nid,))
+    row = c.fetchone()
     c.execute('UPDATE notifications SET status = "read" WHERE id = ?', (nid,))
     commit_doctors()
+    if row:
+        bus.publish(user_topic(row[0]))
 
 def mark_notifications_read_by_request(rid, email):
     c = get_doctors_cursor()
     c.execute('UPDATE notifications SET status = "read" WHERE request_id = ? AND user_email = ?', (rid, email))
-    commit_doctors()
\ No newline at end of file
+    commit_doctors()
+    bus.publish(user_topic(email))
+
+def mark_all_notifications_read(email):
+    c = get_doctors_cursor()
+    c.execute("UPDATE notifications SET status = 'read' WHERE user_email = ? AND status = 'unread'", (email,))
+    commit_doctors()
+    bus.publish(user_topic(email))
+
+def count_unread_notifications(email):
+    c = get_doctors_cursor()
+    c.execute("SELECT COUNT(*) FROM notifications WHERE user_email = ? AND status = 'unread'", (email,))
+    return c.fetchone()[0]
+
+
+bootstrap()
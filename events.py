@@ -0,0 +1,56 @@
+"""
+In-process event bus.
+
+db.py publishes to a topic whenever it commits something a session might
+be showing: chat_topic(rid) for new messages, attachments and status
+changes, user_topic(email) for new notifications. Every topic carries a
+version, so a session can compare it with the version it last rendered
+instead of re-querying SQLite. Versions are only ever compared for
+equality.
+
+Only the EVENT_BUS_TOPICS most recently published topics are kept.
+Versions come from one process-wide sequence, and a topic that is not
+kept reports the highest version evicted so far, so dropping a topic can
+cost a session a spurious re-query but never hides a change.
+
+The bus is process-local, like the Streamlit server it serves.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+EVENT_BUS_TOPICS = int(os.getenv("EVENT_BUS_TOPICS", "100000"))
+
+
+def chat_topic(rid):
+    return f"chat:{int(rid)}"
+
+
+def user_topic(email):
+    return f"user:{email}"
+
+
+class EventBus:
+    def __init__(self, max_topics=EVENT_BUS_TOPICS):
+        self.max_topics = max_topics
+        self._lock = threading.Lock()
+        self._versions = OrderedDict()  # topic -> sequence number of its last publish
+        self._seq = 0
+        self._floor = 0  # highest version evicted so far
+
+    def publish(self, *topics):
+        with self._lock:
+            for topic in topics:
+                self._seq += 1
+                self._versions[topic] = self._seq
+                self._versions.move_to_end(topic)
+            while len(self._versions) > self.max_topics:
+                _, evicted = self._versions.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+
+    def version(self, topic):
+        with self._lock:
+            return self._versions.get(topic, self._floor)
+
+
+bus = EventBus()
@@ -0,0 +1,359 @@
+"""
+Gemini client for the AI symptom checker.
+
+The client is built on first use and shared by every session in the
+process; importing this module makes no network calls. Provider health is
+probed by a background thread and cached for LLM_HEALTH_TTL seconds, so a
+page asking for it never waits on the provider.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import HumanMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = "gemini-2.5-flash"
+HEALTH_TTL = float(os.getenv("LLM_HEALTH_TTL", "300"))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def api_key_problem():
+    """Why GOOGLE_API_KEY can't be used, or None if it looks valid."""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        return "GOOGLE_API_KEY not found!"
+    if not api_key.strip().startswith("AIzaSy"):
+        return "Invalid Google API key format! Key must start with 'AIzaSy'"
+    return None
+
+
+def get_client():
+    """The process-wide Gemini client, or None when no usable key is configured."""
+    global _client
+    if _client is None and api_key_problem() is None:
+        with _client_lock:
+            if _client is None:
+                _client = ChatGoogleGenerativeAI(
+                    model=GEMINI_MODEL,
+                    temperature=0.3,
+                    timeout=LLM_TIMEOUT,
+                    max_retries=0,  # the executor below owns retries and deadlines
+                    google_api_key=os.getenv("GOOGLE_API_KEY").strip()
+                )
+    return _client
+
+
+def response_text(response):
+    """Flatten a chat model response's content (str or list of parts) to a string."""
+    content = response.content
+    if isinstance(content, list):
+        content = " ".join(str(part.get("text", "")) if isinstance(part, dict) else str(part) for part in content)
+    elif not isinstance(content, str):
+        content = str(content)
+    return content
+
+
+class HealthCheck:
+    def __init__(self, ttl=HEALTH_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._running = False
+        self._state = {"status": "unknown", "detail": "", "checked_at": None, "latency_ms": None}
+
+    def status(self):
+        """
+        The last probe result. Starts a new probe in the background when
+        there is none yet or it is older than the TTL; never blocks on it.
+        """
+        with self._lock:
+            checked_at = self._state["checked_at"]
+            stale = checked_at is None or time.time() - checked_at > self.ttl
+            if stale and not self._running:
+                self._running = True
+                threading.Thread(target=self._probe, name="llm-health", daemon=True).start()
+            return dict(self._state)
+
+    def _probe(self):
+        start = time.perf_counter()
+        try:
+            problem = api_key_problem()
+            if problem:
+                status, detail = "unconfigured", problem
+            else:
+                reply = response_text(get_client().invoke([
+                    SystemMessage(content="Respond with exactly one word: 'ready'"),
+                    HumanMessage(content="Test")
+                ]))
+                status, detail = "ok", reply.strip()[:80]
+        except Exception as e:
+            logger.warning("Gemini health check failed: %s", e)
+            status, detail = "error", str(e)
+        with self._lock:
+            self._state = {
+                "status": status,
+                "detail": detail,
+                "checked_at": time.time(),
+                "latency_ms": round((time.perf_counter() - start) * 1000),
+            }
+            self._running = False
+
+
+health = HealthCheck()
+
+
+# ----------------------------------------------------------------------
+# BOUNDED EXECUTOR
+# ----------------------------------------------------------------------
+# Every triage call goes through one process-wide executor instead of
+# running inline on the session's script thread: at most LLM_WORKERS calls
+# reach the provider at once, at most LLM_MAX_PENDING wait, each call has
+# a deadline, transient errors are retried with jittered backoff, and a
+# circuit breaker fails fast while the provider keeps failing. Every way
+# a call can fail surfaces as LLMUnavailable, so callers have one fallback.
+
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))
+LLM_MAX_PENDING = int(os.getenv("LLM_MAX_PENDING", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Exception class names (google.api_core / httpx / grpc) worth another try.
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+    "TooManyRequests", "GatewayTimeout", "ReadTimeout", "ConnectTimeout", "ConnectError",
+}
+
+_DONE = object()
+
+
+class LLMUnavailable(Exception):
+    """The provider could not answer in time (busy, failing, timed out or circuit open)."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        """Closed: yes. Open: no, until the cooldown passes; then one probe call at a time."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self):
+        """A call finished without telling us anything about the provider; free the probe slot."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LLMExecutor:
+    def __init__(self, workers=LLM_WORKERS, max_pending=LLM_MAX_PENDING, timeout=LLM_TIMEOUT,
+                 retries=LLM_RETRIES, breaker=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._stats = {"queued": 0, "running": 0, "calls": 0, "failures": 0, "retries": 0, "rejected": 0,
+                       "cancelled": 0}
+
+    def invoke(self, messages, timeout=None):
+        """client.invoke(messages) on a worker thread; raises LLMUnavailable on any failure."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._admit()
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                future = self._submit(lambda: get_client().invoke(messages))
+                try:
+                    response = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except Exception as e:
+                    future.cancel()
+                    self._retry_or_raise(e, attempt, deadline)
+                    continue
+                self._finish(start, ok=True)
+                return response
+        except BaseException:
+            self._finish(start, ok=False)
+            raise
+
+    def stream(self, messages, timeout=None):
+        """
+        Yield the reply's text chunks as a worker thread receives them.
+        A call is only retried if it failed before its first chunk. Closing
+        the generator early cancels the call without counting it as a failure.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._admit()
+        start = time.perf_counter()
+        ok = cancelled = False
+        try:
+            for attempt in range(self.retries + 1):
+                chunks, stop = queue.Queue(), threading.Event()
+                future = self._submit(self._pump, messages, chunks, stop)
+                started = False
+                try:
+                    while True:
+                        item = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+                        if item is _DONE:
+                            ok = True
+                            return
+                        if isinstance(item, BaseException):
+                            raise item
+                        started = True
+                        yield item
+                except Exception as e:
+                    if started:
+                        raise LLMUnavailable("Gemini stopped answering mid-reply.") from e
+                    self._retry_or_raise(e, attempt, deadline)
+                finally:
+                    # Drop the call if it is still queued, or stop it at its next chunk.
+                    stop.set()
+                    future.cancel()
+        except GeneratorExit:
+            cancelled = True
+            raise
+        finally:
+            self._finish(start, ok=ok, cancelled=cancelled)
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise LLMUnavailable("Too many AI requests in progress.")
+        if not self.breaker.allow():
+            self._slots.release()
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise LLMUnavailable("Gemini is failing; circuit breaker is open.")
+
+    def _finish(self, start, ok, cancelled=False):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if cancelled:
+            self.breaker.release()
+        elif ok:
+            self.breaker.success()
+        else:
+            self.breaker.failure()
+        with self._lock:
+            if cancelled:
+                self._stats["cancelled"] += 1
+            else:
+                self._stats["calls"] += 1
+                if ok:
+                    self._latencies.append(elapsed_ms)
+                else:
+                    self._stats["failures"] += 1
+        self._slots.release()
+
+    def _retry_or_raise(self, error, attempt, deadline):
+        timed_out = isinstance(error, (queue.Empty, FuturesTimeout))
+        transient = timed_out or isinstance(error, (TimeoutError, ConnectionError)) or \
+            type(error).__name__ in TRANSIENT_ERRORS
+        remaining = deadline - time.monotonic()
+        if timed_out or not transient or attempt >= self.retries or remaining <= 0:
+            if timed_out:
+                raise LLMUnavailable(f"Gemini did not answer within {self.timeout:g}s.") from None
+            raise LLMUnavailable(f"Gemini call failed: {error}") from error
+        with self._lock:
+            self._stats["retries"] += 1
+        time.sleep(min(remaining, 0.5 * 2 ** attempt * random.uniform(0.5, 1.5)))
+
+    def _submit(self, fn, *args):
+        """Queue fn(*args) on the pool; the returned future can be cancelled until a worker takes it."""
+        with self._lock:
+            self._stats["queued"] += 1
+        future = self._pool.submit(self._run, fn, *args)
+        future.add_done_callback(self._dequeue_cancelled)
+        return future
+
+    def _dequeue_cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self._stats["queued"] -= 1
+
+    def _run(self, fn, *args):
+        with self._lock:
+            self._stats["queued"] -= 1
+            self._stats["running"] += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._stats["running"] -= 1
+
+    @staticmethod
+    def _pump(messages, chunks, stop):
+        """Feed the reply's chunks to `chunks` until it ends or the caller sets `stop`."""
+        if stop.is_set():
+            return
+        try:
+            replies = get_client().stream(messages)
+            try:
+                for chunk in replies:
+                    if stop.is_set():
+                        return
+                    chunks.put(response_text(chunk))
+            finally:
+                close = getattr(replies, "close", None)
+                if close:
+                    close()
+            chunks.put(_DONE)
+        except BaseException as e:
+            chunks.put(e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+        stats["queue_depth"] = stats.pop("queued")
+        stats["breaker"] = self.breaker.state
+        for p in (50, 95, 99):
+            stats[f"p{p}_ms"] = round(latencies[min(len(latencies) - 1, len(latencies) * p // 100)]) \
+                if latencies else None
+        return stats
+
+
+executor = LLMExecutor()
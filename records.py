@@ -0,0 +1,135 @@
+"""
+Compact row types for db.py result sets.
+
+A record is a tuple subclass (no per-row dict), built straight from the
+sqlite3 row tuple with Cls._make(row). It also behaves as a read-only
+mapping, so the UI keeps using r['key'], r.get('key', default), `in`,
+dict(r) and r.status unchanged:
+
+    >>> r = TriageResult._make(("Neurology", "High", "See a neurologist.", "None"))
+    >>> r.specialty, r['urgency'], dict(r)['recommendation']
+    ('Neurology', 'High', 'See a neurologist.')
+    >>> d = DoctorSummary._make(("d@x.com", "Dr. A", "1", "Cardiology", "D1", "MBBS"))
+    >>> d.name, d['role'], len(dict(d))
+    ('Dr. A', 'doctor', 7)
+
+pandas takes a tuple subclass with _fields for a namedtuple and gets
+both its columns and its cells wrong, so pass rows through as_dicts()
+before building a DataFrame:
+
+    >>> import pandas as pd
+    >>> pd.DataFrame(as_dicts([d])).loc[0, ["email", "role"]].tolist()
+    ['d@x.com', 'doctor']
+    >>> p = PatientSummary._make(("p@x.com", "Pat", "2", "P1"))
+    >>> pd.DataFrame(as_dicts([p])).to_dict("records")
+    [{'email': 'p@x.com', 'name': 'Pat', 'mobile': '2', 'patient_id': 'P1'}]
+
+Run these checks with `python -m doctest records.py`.
+"""
+from collections.abc import Mapping
+
+
+class Record(tuple):
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+    _constants = {}
+
+    _make = classmethod(tuple.__new__)
+
+    def __getitem__(self, key):
+        i = self._index.get(key)
+        if i is not None:
+            return tuple.__getitem__(self, i)
+        return self._constants[key]
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        if i is not None:
+            return tuple.__getitem__(self, i)
+        return self._constants.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._index or key in self._constants
+
+    def keys(self):
+        return list(self._index) + list(self._constants)
+
+    def values(self):
+        return list(tuple.__iter__(self)) + list(self._constants.values())
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._index) + len(self._constants)
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = tuple.__hash__
+
+    def __getnewargs__(self):
+        return (tuple(tuple.__iter__(self)),)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+Mapping.register(Record)
+
+
+def record_type(name, fields, **constants):
+    """
+    Build a Record subclass for a SELECT's column list.
+    Keyword arguments become constant keys shared by every row
+    (e.g. role="doctor"), stored once on the class.
+    """
+    fields = tuple(fields)
+    ns = {
+        "__slots__": (),
+        "__module__": __name__,
+        "_fields": fields,
+        "_index": {f: i for i, f in enumerate(fields)},
+        "_constants": dict(constants),
+    }
+    for i, f in enumerate(fields):
+        # Positional, so it bypasses Record.__getitem__, which takes keys only.
+        ns[f] = property(lambda self, _i=i: tuple.__getitem__(self, _i))
+    return type(name, (Record,), ns)
+
+
+def as_dicts(rows):
+    """Records as plain dicts, for consumers that treat tuples as sequences (pd.DataFrame)."""
+    return [dict(r) for r in rows]
+
+
+ChatRequest = record_type("ChatRequest", [
+    "request_id", "patient_email", "doctor_email", "specialty", "doctor_name", "doctor_id",
+    "qualification", "query", "status", "patient_name", "patient_id", "flag", "timestamp",
+    "closed_at", "archived_at"
+])
+ChatMessage = record_type("ChatMessage", ["id", "sender", "role", "text", "timestamp"])
+ChatAttachment = record_type("ChatAttachment", ["id", "sender", "role", "filename", "file_path", "timestamp"])
+TimelineItem = record_type("TimelineItem", ["kind", "id", "sender", "role", "text", "filename", "file_path",
+                                            "ts", "timestamp"])
+Notification = record_type("Notification", ["id", "message", "status", "timestamp", "request_id"])
+Prescription = record_type("Prescription", ["id", "request_id", "doctor_name", "medicines", "advice", "timestamp"])
+Submission = record_type("Submission", ["id", "date", "symptoms", "prediction", "patient_email"])
+Feedback = record_type("Feedback", ["user_email", "feedback", "timestamp"])
+DoctorSummary = record_type("DoctorSummary", ["email", "name", "mobile", "specialty", "doc_id", "qualification"],
+                            role="doctor")
+PatientSummary = record_type("PatientSummary", ["email", "name", "mobile", "patient_id"])
+SearchHit = record_type("SearchHit", ["kind", "request_id", "snippet", "score", "timestamp", "patient_name",
+                                      "doctor_name"])
+SubmissionHit = record_type("SubmissionHit", ["id", "date", "snippet", "prediction", "patient_email", "score"])
+TriageResult = record_type("TriageResult", ["specialty", "urgency", "recommendation", "emergency_advice"])
@@ -0,0 +1,109 @@
+"""
+Content-addressed attachment store.
+
+Uploads are copied to disk in CHUNK_SIZE pieces while their SHA-256 is
+computed, then moved to uploads/blobs/<aa>/<sha256><ext>. Identical files
+are kept once no matter how many chats reference them; chat_attachments
+rows carry the per-chat filename and point at the shared blob.
+
+Image blobs also get a small JPEG thumbnail under uploads/thumbs/, made
+once and reused by every transcript that shows the image.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow ships with Streamlit; keep storage usable without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads"
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+THUMB_DIR = os.path.join(UPLOAD_DIR, "thumbs")
+CHUNK_SIZE = 1024 * 1024
+THUMB_SIZE = (320, 320)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def is_image(filename):
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def blob_path(digest, ext=""):
+    return os.path.join(BLOB_DIR, digest[:2], digest + ext)
+
+
+def store_attachment(fileobj, filename):
+    """
+    Store an uploaded file-like object; returns (path, sha256, size).
+    Copying adds at most one chunk on top of the source, but a Streamlit
+    UploadedFile is already fully buffered in memory (capped by
+    server.maxUploadSize), so the upload itself is not streamed.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    if hasattr(fileobj, "seek"):
+        fileobj.seek(0)
+
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        digest = sha.hexdigest()
+        path = blob_path(digest, ext)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, digest, size
+
+
+def thumbnail_path(file_path):
+    """
+    Return the cached thumbnail for an image file, creating it on first use.
+    Keyed by the blob name (its SHA-256) so shared blobs share a thumbnail;
+    pre-blob uploads fall back to a hash of their path. Returns None when
+    the original is missing or cannot be decoded.
+    """
+    if Image is None or not os.path.exists(file_path):
+        return None
+    key = os.path.splitext(os.path.basename(file_path))[0]
+    if not file_path.startswith(BLOB_DIR):
+        key = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()
+    thumb = os.path.join(THUMB_DIR, key[:2], key + ".jpg")
+    if os.path.exists(thumb):
+        return thumb
+
+    try:
+        with Image.open(file_path) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail(THUMB_SIZE)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(thumb), prefix=".thumb-")
+            with os.fdopen(fd, "wb") as out:
+                img.save(out, "JPEG", quality=80, optimize=True)
+            os.replace(tmp_path, thumb)
+    except Exception:
+        logger.warning("Could not create thumbnail for %s", file_path, exc_info=True)
+        return None
+    return thumb
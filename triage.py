@@ -0,0 +1,162 @@
+"""
+Symptom triage: the Gemini prompt, its reply format and a result cache.
+
+Results are cached on normalized symptom text plus PROMPT_VERSION in two
+tiers: an in-process LRU shared by all sessions, backed by the
+triage_cache table in patients.db so they survive restarts. Both tiers
+expire entries after TRIAGE_CACHE_TTL seconds and evict least recently
+used ones beyond their size limit. Bump PROMPT_VERSION whenever
+TRIAGE_PROMPT changes so stale answers are never served.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from db import get_cached_triage, put_cached_triage
+from records import TriageResult
+
+PROMPT_VERSION = "1"
+
+TRIAGE_PROMPT = """
+You are an expert medical triage assistant.
+Analyze symptoms and recommend ONE specialty only.
+Detect emergencies.
+Never diagnose or prescribe.
+
+Respond exactly in this format:
+
+SPECIALTY: [One specialty]
+URGENCY: [Low / Moderate / High / Emergency]
+RECOMMENDATION: [1-2 sentences, simple language]
+EMERGENCY_ADVICE: [Strong warning if needed, else "None"]
+                            """
+
+TRIAGE_DEFAULTS = {
+    "SPECIALTY": "General Physician",
+    "URGENCY": "Low",
+    "RECOMMENDATION": "Please consult a doctor.",
+    "EMERGENCY_ADVICE": "None"
+}
+
+# Shown when the model can't be reached; deliberately not "Low" urgency.
+FALLBACK_TRIAGE = TriageResult._make((
+    "General Physician",
+    "Moderate",
+    "We couldn't reach the AI assistant, so no specialist is suggested. A general physician can assess "
+    "your symptoms and refer you if needed.",
+    "None"
+))
+
+TRIAGE_STREAMING = os.getenv("TRIAGE_STREAMING", "1") != "0"
+
+TRIAGE_CACHE_TTL = float(os.getenv("TRIAGE_CACHE_TTL", str(24 * 3600)))
+TRIAGE_CACHE_MEMORY_SIZE = int(os.getenv("TRIAGE_CACHE_MEMORY_SIZE", "512"))
+TRIAGE_CACHE_DB_ROWS = int(os.getenv("TRIAGE_CACHE_DB_ROWS", "10000"))
+
+
+def normalize_symptoms(text):
+    """Case-, punctuation- and whitespace-insensitive form of a symptom description."""
+    return " ".join(re.findall(r"\w+", unicodedata.normalize("NFKC", text).lower()))
+
+
+def parse_triage_line(line):
+    """(FIELD, value) for a recognised reply line, else None."""
+    if ':' in line:
+        k, v = line.split(':', 1)
+        key = k.strip().upper()
+        if key in TRIAGE_DEFAULTS:
+            return key, v.strip()
+    return None
+
+
+def parse_triage(text):
+    """The reply's recognised FIELD: value lines, as a dict of the fields present."""
+    return dict(filter(None, map(parse_triage_line, text.split('\n'))))
+
+
+def iter_triage_fields(chunks):
+    """
+    Yield (FIELD, value) from a streamed reply as soon as each line is
+    complete, so URGENCY can be acted on before the rest has arrived.
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            field = parse_triage_line(line)
+            if field:
+                yield field
+    field = parse_triage_line(pending)
+    if field:
+        yield field
+
+
+def triage_result(found):
+    """A TriageResult from parsed fields, with defaults for any that are missing."""
+    fields = {**TRIAGE_DEFAULTS, **found}
+    return TriageResult._make((fields["SPECIALTY"], fields["URGENCY"], fields["RECOMMENDATION"],
+                               fields["EMERGENCY_ADVICE"]))
+
+
+class TriageCache:
+    def __init__(self, ttl=TRIAGE_CACHE_TTL, memory_size=TRIAGE_CACHE_MEMORY_SIZE, db_rows=TRIAGE_CACHE_DB_ROWS):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.db_rows = db_rows
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (stored_at, TriageResult)
+        self._stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(symptoms):
+        normalized = normalize_symptoms(symptoms)
+        return hashlib.sha256(f"{PROMPT_VERSION}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, stored_at, result):
+        with self._lock:
+            self._memory[key] = (stored_at, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get(self, symptoms):
+        key = self.key(symptoms)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and time.time() - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+                self._stats["evictions"] += 1
+
+        result = get_cached_triage(key, self.ttl)
+        with self._lock:
+            self._stats["db_hits" if result else "misses"] += 1
+        if result:
+            self._remember(key, time.time(), result)
+        return result
+
+    def put(self, symptoms, result):
+        key = self.key(symptoms)
+        self._remember(key, time.time(), result)
+        evicted = put_cached_triage(key, PROMPT_VERSION, result, self.ttl, self.db_rows)
+        with self._lock:
+            self._stats["evictions"] += evicted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._memory))
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = round(100 * (stats["memory_hits"] + stats["db_hits"]) / lookups, 1) if lookups else 0.0
+        return stats
+
+
+triage_cache = TriageCache()
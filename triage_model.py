@@ -0,0 +1,257 @@
+"""
+Local offline triage model.
+
+Symptom text is turned into hashed word uni/bigram and character trigram
+features, and two softmax regressions (NumPy, trained with mini-batch
+SGD) map them to a specialty and to an urgency level. Specialties are
+MOCK_SPECIALTIES, General Physician, and "Other" for answers naming a
+specialty the app has no doctors for. Training data is the submissions
+table: every symptom check the LLM answered. Predictions take well under
+a millisecond, so the symptom checker asks the local model first. Its
+answer is used directly when both heads are at least
+LOCAL_TRIAGE_CONFIDENCE sure, and also as the fallback when Gemini is
+unavailable.
+
+The model trains on a background thread on first use, on at most
+LOCAL_TRIAGE_MAX_ROWS of the newest rows, and retrains every
+LOCAL_TRIAGE_RETRAIN_HOURS; until it has LOCAL_TRIAGE_MIN_ROWS usable
+rows it makes no predictions. Red-flag phrases always yield Emergency.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from db import get_triage_training_rows, release_connections
+from records import TriageResult
+from utils import MOCK_SPECIALTIES
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 2 ** 16
+LOCAL_TRIAGE_CONFIDENCE = float(os.getenv("LOCAL_TRIAGE_CONFIDENCE", "0.8"))
+LOCAL_TRIAGE_MIN_ROWS = int(os.getenv("LOCAL_TRIAGE_MIN_ROWS", "30"))
+LOCAL_TRIAGE_RETRAIN_HOURS = float(os.getenv("LOCAL_TRIAGE_RETRAIN_HOURS", "24"))
+LOCAL_TRIAGE_MAX_ROWS = int(os.getenv("LOCAL_TRIAGE_MAX_ROWS", "20000"))
+LOCAL_TRIAGE_EPOCHS = int(os.getenv("LOCAL_TRIAGE_EPOCHS", "10"))
+
+GENERAL_PHYSICIAN = "General Physician"
+# LLM answers naming a specialty this app has no doctors for (dermatology,
+# psychiatry, ...).
+OUT_OF_SCOPE = "Other"
+SPECIALTY_LABELS = MOCK_SPECIALTIES + [GENERAL_PHYSICIAN, OUT_OF_SCOPE]
+URGENCY_LABELS = ["Low", "Moderate", "High", "Emergency"]
+
+# Free-text LLM specialties -> SPECIALTY_LABELS, by word stem.
+_SPECIALTY_STEMS = {
+    "Cardiology": ("cardi", "heart"),
+    "Orthopedics (Bone)": ("orthop", "bone"),
+    "Pulmonology (Lung)": ("pulmo", "lung", "respir"),
+    "Nephrology (Kidney)": ("nephr", "kidney", "renal"),
+    "Neurology": ("neuro",),
+    "Pediatrics": ("pediat", "paediat"),
+    GENERAL_PHYSICIAN: ("general", "primary", "family", "internal", "practi"),
+}
+
+RED_FLAGS = (
+    "chest pain", "crushing chest", "can't breathe", "cannot breathe", "not breathing", "unconscious",
+    "unresponsive", "seizure", "stroke", "face drooping", "slurred speech", "severe bleeding",
+    "coughing blood", "vomiting blood", "suicidal", "overdose", "anaphylaxis", "throat swelling",
+)
+
+EMERGENCY_ADVICE = "Call your local emergency number or go to the nearest emergency department now."
+
+
+def specialty_label(prediction):
+    """The SPECIALTY_LABELS entry a free-text specialty refers to (OUT_OF_SCOPE if none), or None if blank."""
+    text = (prediction or "").strip().lower()
+    if not text:
+        return None
+    for label, stems in _SPECIALTY_STEMS.items():
+        if any(stem in text for stem in stems):
+            return label
+    return OUT_OF_SCOPE
+
+
+def urgency_label(urgency):
+    text = (urgency or "").strip().lower()
+    for label in URGENCY_LABELS:
+        if text.startswith(label.lower()):
+            return label
+    return None
+
+
+def has_red_flag(text):
+    text = " ".join(text.lower().replace("’", "'").split())
+    return any(flag in text for flag in RED_FLAGS)
+
+
+def features(text):
+    """Sorted unique hashed feature indices of a symptom description."""
+    words = re.findall(r"\w+", text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        grams += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams),
+                                 dtype=np.int64, count=len(grams)))
+
+
+class SoftmaxRegression:
+    """Multinomial logistic regression over binary hashed features, L2-normalised per example."""
+
+    def __init__(self, labels, n_features=N_FEATURES):
+        self.labels = list(labels)
+        self.W = np.zeros((n_features, len(self.labels)), dtype=np.float32)
+        self.b = np.zeros(len(self.labels), dtype=np.float32)
+
+    def _proba(self, idx):
+        z = self.W[idx].sum(axis=0) / np.sqrt(max(len(idx), 1)) + self.b
+        z = np.exp(z - z.max())
+        return z / z.sum()
+
+    def fit(self, X, y, epochs=LOCAL_TRIAGE_EPOCHS, lr=0.5, batch_size=64, seed=0):
+        """
+        Mini-batch SGD. Each batch is a handful of whole-array NumPy calls,
+        so the Python loop runs once per batch rather than once per example.
+        """
+        rng = np.random.default_rng(seed)
+        y = np.asarray(y)
+        lengths = np.array([len(idx) for idx in X])
+        for epoch in range(epochs):
+            step = lr / (1 + epoch)
+            order = rng.permutation(len(X))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                n = lengths[batch]
+                cols = np.concatenate([X[i] for i in batch])
+                scale = 1 / np.sqrt(n)[:, None]
+                z = np.add.reduceat(self.W[cols], np.cumsum(n) - n, axis=0) * scale + self.b
+                grad = np.exp(z - z.max(axis=1, keepdims=True))
+                grad /= grad.sum(axis=1, keepdims=True)
+                grad[np.arange(len(batch)), y[batch]] -= 1
+                # Sparse weights take each example's full step (as plain SGD
+                # would); the shared bias takes the batch mean.
+                np.add.at(self.W, cols, np.repeat((-step * scale * grad).astype(np.float32), n, axis=0))
+                self.b -= step * grad.mean(axis=0)
+        return self
+
+    def predict(self, idx):
+        """(label, probability) of the most likely class."""
+        p = self._proba(idx)
+        best = int(p.argmax())
+        return self.labels[best], float(p[best])
+
+
+class LocalTriage:
+    def __init__(self, min_rows=LOCAL_TRIAGE_MIN_ROWS, retrain_hours=LOCAL_TRIAGE_RETRAIN_HOURS,
+                 confidence=LOCAL_TRIAGE_CONFIDENCE):
+        self.min_rows = min_rows
+        self.retrain_seconds = retrain_hours * 3600
+        self.confidence = confidence
+        self._lock = threading.Lock()
+        self._training = False
+        self._trained_at = None
+        self._specialty = None
+        self._urgency = None
+        self._stats = {"rows": 0, "fast_path": 0, "escalated": 0, "fallback": 0}
+
+    def _maybe_retrain(self):
+        with self._lock:
+            # Without a model yet (too little data), look again sooner.
+            interval = self.retrain_seconds if self._specialty is not None else min(self.retrain_seconds, 600)
+            stale = self._trained_at is None or time.time() - self._trained_at > interval
+            if stale and not self._training:
+                self._training = True
+                threading.Thread(target=self._train, name="local-triage-train", daemon=True).start()
+
+    def _train(self):
+        try:
+            specialty_X, specialty_y, urgency_X, urgency_y = [], [], [], []
+            for symptoms, prediction, urgency in get_triage_training_rows(limit=LOCAL_TRIAGE_MAX_ROWS):
+                idx = features(symptoms)
+                if not len(idx):
+                    continue
+                label = specialty_label(prediction)
+                if label:
+                    specialty_X.append(idx)
+                    specialty_y.append(SPECIALTY_LABELS.index(label))
+                label = urgency_label(urgency)
+                if label:
+                    urgency_X.append(idx)
+                    urgency_y.append(URGENCY_LABELS.index(label))
+
+            specialty = urgency = None
+            if len(specialty_X) >= self.min_rows:
+                specialty = SoftmaxRegression(SPECIALTY_LABELS).fit(specialty_X, specialty_y)
+            if len(urgency_X) >= self.min_rows:
+                urgency = SoftmaxRegression(URGENCY_LABELS).fit(urgency_X, urgency_y)
+            with self._lock:
+                self._specialty, self._urgency = specialty, urgency
+                self._stats["rows"] = len(specialty_X)
+        except Exception:
+            logger.exception("Local triage model training failed")
+        finally:
+            release_connections()
+            with self._lock:
+                self._trained_at = time.time()
+                self._training = False
+
+    def ready(self):
+        """Whether a specialty model is available; starts (re)training when due."""
+        self._maybe_retrain()
+        return self._specialty is not None
+
+    def predict(self, text):
+        """
+        (TriageResult, confidence) for `text`, or None while no model is
+        trained. Confidence is the lower of the two heads' probabilities;
+        a red flag makes the urgency Emergency with full confidence.
+        """
+        self._maybe_retrain()
+        specialty_model, urgency_model = self._specialty, self._urgency
+        if specialty_model is None:
+            return None
+        idx = features(text)
+        specialty, confidence = specialty_model.predict(idx)
+        if specialty == OUT_OF_SCOPE:
+            # Outside what the app's doctors cover: always ask the LLM, and
+            # as a fallback send the patient to a general physician.
+            specialty, confidence = GENERAL_PHYSICIAN, 0.0
+        if has_red_flag(text):
+            urgency, urgency_confidence = "Emergency", 1.0
+        elif urgency_model is not None:
+            urgency, urgency_confidence = urgency_model.predict(idx)
+        else:
+            urgency, urgency_confidence = "Moderate", 0.0
+        result = TriageResult._make((
+            specialty,
+            urgency,
+            f"Patients describing similar symptoms were usually referred to {specialty}. "
+            "A doctor will confirm this with you.",
+            EMERGENCY_ADVICE if urgency == "Emergency" else "None",
+        ))
+        return result, min(confidence, urgency_confidence)
+
+    def confident(self, prediction):
+        return prediction is not None and prediction[1] >= self.confidence
+
+    def record(self, outcome):
+        """Count how a triage was answered: 'fast_path', 'escalated' or 'fallback'."""
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["trained_at"] = self._trained_at
+            stats["ready"] = self._specialty is not None
+            stats["urgency_ready"] = self._urgency is not None
+        return stats
+
+
+local_triage = LocalTriage()
@@ -16,21 +16,33 @@ import os
 import re
 from dotenv import load_dotenv
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from db import (
     register_patient, get_patient, get_doctor, get_all_doctors,
-    get_chat_requests, add_chat_request, update_chat_request_status,
-    get_chat_messages, add_chat_message, get_submissions, add_submission,
+    get_chat_requests, get_chat_request, chat_request_cursor, add_chat_request, update_chat_request_status,
+    add_chat_message, get_chat_timeline, timeline_cursor, is_chat_archived,
+    get_submissions, add_submission,
     get_feedback, add_feedback, get_notifications, mark_notification_read,
-    mark_notifications_read_by_request, add_doctor,
+    mark_notifications_read_by_request, mark_all_notifications_read, count_unread_notifications,
+    notifications_version, add_doctor,
     save_otp, get_otp, increment_otp_attempts, delete_otp, send_verification_email,
     check_password,
-    add_chat_attachment, get_chat_attachments,
-    add_prescription, get_prescriptions_for_patient,
-    get_all_patients
+    add_chat_attachment,
+    add_prescription, get_prescriptions_for_patient, chat_version, release_connections,
+    get_all_patients, notification_queue_stats, search_consultations, search_submissions
 )
+from llm import (
+    get_client, api_key_problem, response_text, LLMUnavailable,
+    health as llm_health, executor as llm_executor
+)
+from records import as_dicts
+from storage import store_attachment, thumbnail_path, is_image
+from triage import (
+    TRIAGE_PROMPT, TRIAGE_DEFAULTS, TRIAGE_STREAMING, FALLBACK_TRIAGE,
+    parse_triage, iter_triage_fields, triage_result, triage_cache
+)
+from triage_model import local_triage
 from utils import (
     PRIMARY_BLUE, SECONDARY_BLUE, NAV_BAR_BG, MOCK_SPECIALTIES,
     logout, set_page_style
@@ -51,73 +63,34 @@ def is_valid_email(email: str) -> bool:
 def is_valid_mobile(mobile: str) -> bool:
     return bool(mobile and mobile.isdigit() and len(mobile) == 10)
 
-# ────────────────────────────────────────────────────────────────
-# Gemini setup (unchanged)
-# ────────────────────────────────────────────────────────────────
-
-client = None
-api_key = os.getenv("GOOGLE_API_KEY")
-
-if not api_key:
-    st.error("GOOGLE_API_KEY not found!")
-    st.code("Create a '.env' file with:\nGOOGLE_API_KEY=AIzaSyYourRealKeyHere")
-    st.info("Get free key from: https://aistudio.google.com/app/apikey")
-elif not api_key.strip().startswith("AIzaSy"):
-    st.error("Invalid Google API key format! Key must start with 'AIzaSy'")
-    st.info("Create a new key at https://aistudio.google.com/app/apikey")
-else:
-    api_key = api_key.strip()
-    try:
-        client = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            temperature=0.3,
-            google_api_key=api_key
-        )
-
-        test_response = client.invoke([
-            SystemMessage(content="Respond with exactly one word: 'ready'"),
-            HumanMessage(content="Test")
-        ])
-
-        content = test_response.content
-        if isinstance(content, list):
-            content = " ".join([str(part) if isinstance(part, str) else str(part.get("text", "")) for part in content])
-        elif not isinstance(content, str):
-            content = str(content)
-
-        if "ready" in content.lower():
-            st.success("Gemini AI connected successfully! AI Symptom Checker is ready. 🚀")
-            st.caption("Powered by Google Gemini 1.5 Flash — fast & excellent medical reasoning ✨")
-        else:
-            st.success("Gemini connected! AI Symptom Checker is ready.")
-            st.caption("Using Gemini 1.5 Flash")
-
-    except Exception as e:
-        st.error(f"Gemini connection failed: {str(e)}")
-        st.info("""
-Common fixes (January 2026):
-• Recommended stable model: `gemini-1.5-flash`
-• Latest preview (if available): `gemini-1.5-flash-latest`
-• Valid API key from https://aistudio.google.com/app/apikey
-• Update packages: pip install --upgrade langchain-google-genai google-generativeai
-• Check quota & billing at Google AI Studio
-        """)
-        client = None
-
 if 'patient_show_register' not in st.session_state:
     st.session_state.patient_show_register = False
 
-if 'next_request_id' not in st.session_state:
-    st.session_state.next_request_id = 1001
-
 if 'next_doc_id' not in st.session_state:
     st.session_state.next_doc_id = f"{randint(200, 999)}"
 
 
+NOTIFICATIONS_LIMIT = 20
+
+
+def load_notifications(user_email):
+    """Latest notifications and unread count, re-queried only when the user's event topic has moved."""
+    cache = st.session_state.get('notifications_cache')
+    version = notifications_version(user_email)
+    if not cache or cache['email'] != user_email or cache['version'] != version:
+        cache = {
+            "email": user_email,
+            "version": version,
+            "items": get_notifications(user_email, limit=NOTIFICATIONS_LIMIT),
+            "unread": count_unread_notifications(user_email),
+        }
+        st.session_state.notifications_cache = cache
+    return cache["items"], cache["unread"]
+
+
 def show_notifications():
     user_email = st.session_state.user_profile['email']
-    notifications = get_notifications(user_email)
-    unread_count = len([n for n in notifications if n['status'] == 'unread'])
+    notifications, unread_count = load_notifications(user_email)
 
     st.markdown(f"## Notifications <span class='notification-badge'>{unread_count}</span>", unsafe_allow_html=True)
     st.markdown('<div class="notification-container">', unsafe_allow_html=True)
@@ -139,10 +112,8 @@ def show_notifications():
                         st.session_state.active_chat_request = notification['request_id']
                         st.session_state.portal_view = "LiveChat"
                     st.rerun()
-        if st.button("Mark All as Read"):
-            for n in notifications:
-                if n['status'] == 'unread':
-                    mark_notification_read(n['id'])
+        if unread_count and st.button("Mark All as Read"):
+            mark_all_notifications_read(user_email)
             st.rerun()
 
     st.markdown('</div>', unsafe_allow_html=True)
@@ -165,7 +136,7 @@ def draw_post_login_navbar(view_options):
             if st.button(display_name, key=f"nav_btn_{internal_key}", type="secondary"):
                 if internal_key in ["ViewDoctors", "Dashboard", "RequestChat", "GiveFeedback", "DoctorDetails",
                                     "ViewUsers", "ViewRequests", "AddDoctor", "ViewFeedback", "AssignChat",
-                                    "WritePrescription", "MyPrescriptions"]:
+                                    "WritePrescription", "MyPrescriptions", "SystemHealth"]:
                     st.session_state.active_chat_request = None
                 if st.session_state.user_profile['role'] == 'admin':
                     st.session_state.admin_view = internal_key
@@ -193,6 +164,8 @@ def show_admin_portal():
         "View User": "ViewUsers",
         "View Feedback": "ViewFeedback",
         "Assign Chat": "AssignChat",
+        "Search": "Search",
+        "System Health": "SystemHealth",
     }
     draw_post_login_navbar(nav_options)
 
@@ -207,6 +180,10 @@ def show_admin_portal():
         show_view_feedback()
     elif view == "AssignChat":
         show_assign_chat_form()
+    elif view == "Search":
+        show_search()
+    elif view == "SystemHealth":
+        show_system_health()
 
 
 def show_add_doctor_form():
@@ -710,7 +687,8 @@ def show_doctor_portal():
         "Details": "DoctorDetails",
         "View User": "ViewUsers",
         "View Request": "ViewRequests",
-        "Write Prescription": "WritePrescription"
+        "Write Prescription": "WritePrescription",
+        "Search": "Search",
     }
     draw_post_login_navbar(nav_options)
 
@@ -727,6 +705,8 @@ def show_doctor_portal():
         show_view_requests()
     elif view == "WritePrescription":
         show_generate_prescription()
+    elif view == "Search":
+        show_search()
     else:
         show_doctor_dashboard()
 
@@ -756,11 +736,7 @@ def show_doctor_dashboard():
             st.error("Doctor email not found.")
             return
 
-        all_requests = get_chat_requests() or []
-        pending = [
-            r for r in all_requests
-            if r.get("doctor_email") == my_email and r.get("status") == "Pending"
-        ]
+        pending, has_more = fetch_chat_requests_page("pending_requests", doctor_email=my_email, status="Pending")
     except Exception as e:
         st.error(f"Failed to load requests: {e}")
         return
@@ -830,6 +806,8 @@ def show_doctor_dashboard():
                 except Exception as e:
                     st.error(f"Failed to accept: {e}")
 
+    draw_chat_requests_pager("pending_requests", pending, has_more)
+
     st.markdown("---")
     st.subheader("Patient Details")
 
@@ -856,7 +834,7 @@ def show_generate_prescription():
         st.warning("No active chat selected. Please go to Live Chat first.")
         return
 
-    req = next((r for r in get_chat_requests() if r['request_id'] == rid), None)
+    req = get_chat_request(rid)
     if not req:
         st.error("Chat request not found.")
         return
@@ -940,9 +918,42 @@ def show_doctor_details():
     st.metric("ID", u.get('doc_id', 'N/A'))
 
 
+REQUESTS_PAGE_SIZE = 25
+
+
+def fetch_chat_requests_page(key, **filters):
+    """One keyset page of chat requests; the cursor stack lives in session state under `key`."""
+    cursors_key = f"{key}_cursors"
+    if cursors_key not in st.session_state:
+        st.session_state[cursors_key] = [None]
+    rows = get_chat_requests(limit=REQUESTS_PAGE_SIZE + 1, before=st.session_state[cursors_key][-1], **filters)
+    if not rows and len(st.session_state[cursors_key]) > 1:
+        # The page we were on emptied out (e.g. its requests were accepted); start over.
+        st.session_state[cursors_key] = [None]
+        rows = get_chat_requests(limit=REQUESTS_PAGE_SIZE + 1, **filters)
+    return rows[:REQUESTS_PAGE_SIZE], len(rows) > REQUESTS_PAGE_SIZE
+
+
+def draw_chat_requests_pager(key, rows, has_more):
+    cursors = st.session_state[f"{key}_cursors"]
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if len(cursors) > 1 and st.button("← Newer", key=f"{key}_newer"):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Page {len(cursors)}")
+    with col_next:
+        if has_more and rows and st.button("Older →", key=f"{key}_older"):
+            cursors.append(chat_request_cursor(rows[-1]))
+            st.rerun()
+
+
 def show_view_requests():
     st.header("All Chat Requests")
-    requests = get_chat_requests()
+    status = st.selectbox("Status", ["All", "Pending", "Accepted", "Closed"], key="view_requests_status")
+    key = f"view_requests_{status}"
+    requests, has_more = fetch_chat_requests_page(key, status=None if status == "All" else status)
     if not requests:
         st.info("No chat requests found.")
         return
@@ -967,6 +978,101 @@ def show_view_requests():
 
     df = pd.DataFrame(data)
     st.markdown(df.to_html(escape=False, index=False), unsafe_allow_html=True)
+    draw_chat_requests_pager(key, requests, has_more)
+
+    user = st.session_state.user_profile
+    request_ids = [r['request_id'] for r in requests if can_view_chat(user, r)]
+    if request_ids:
+        st.markdown("---")
+        selected = st.selectbox("View transcript", ["--"] + request_ids, key=f"{key}_transcript")
+        if selected != "--":
+            show_chat_history(selected)
+
+
+def can_view_chat(user, request):
+    """Admins may read any transcript; a doctor only those of their own chats."""
+    return request is not None and (user['role'] == 'admin' or request['doctor_email'] == user['email'])
+
+
+def show_chat_history(rid):
+    """Read-only transcript of a chat, including archived ones, newest CHAT_WINDOW items first."""
+    if not can_view_chat(st.session_state.user_profile, get_chat_request(rid)):
+        st.error("You can only view transcripts of your own consultations.")
+        return
+    window_key = f"history_window_{rid}"
+    window = st.session_state.get(window_key, CHAT_WINDOW)
+    items = get_chat_timeline(rid, limit=window + 1)
+    if not items:
+        st.info("No messages in this chat.")
+        return
+    if is_chat_archived(rid):
+        st.caption("Served from the archive.")
+    if len(items) > window:
+        if st.button("Load older messages", key=f"history_older_{rid}"):
+            st.session_state[window_key] = window + CHAT_WINDOW
+            st.rerun()
+        items = items[1:]
+    render_chat_items(items)
+
+
+SEARCH_PAGE_SIZE = 20
+
+
+def show_search():
+    st.header("Search Consultations")
+    user = st.session_state.user_profile
+    # Doctors search only their own consultations; symptom checks are admin-only.
+    is_admin = user['role'] == 'admin'
+    text = st.text_input("🔍 Search messages, queries, prescriptions and symptoms" if is_admin else
+                         "🔍 Search messages, queries and prescriptions in your consultations", key="search_text")
+    source = st.radio("Search in", ["Consultations", "Symptom checks"], horizontal=True,
+                      key="search_source") if is_admin else "Consultations"
+    doctor_email = None if is_admin else user['email']
+    if not text.strip():
+        return
+
+    # Start from the first page whenever the search changes.
+    search_key = (text, source)
+    if st.session_state.get("search_key") != search_key:
+        st.session_state.search_key = search_key
+        st.session_state.search_offset = 0
+    offset = st.session_state.search_offset
+
+    if source == "Consultations":
+        hits, has_more = search_consultations(text, doctor_email=doctor_email,
+                                              limit=SEARCH_PAGE_SIZE, offset=offset)
+    else:
+        hits, has_more = search_submissions(text, limit=SEARCH_PAGE_SIZE, offset=offset)
+    if not hits:
+        st.info("No matches found.")
+        return
+
+    for hit in hits:
+        if source == "Consultations":
+            st.markdown(f"**Chat #{hit['request_id']}** · {hit['kind'].title()} · "
+                        f"{hit['patient_name']} / Dr. {hit['doctor_name']} · {hit['timestamp']}")
+        else:
+            st.markdown(f"**{hit['patient_email']}** · {hit['prediction']} · {hit['date']}")
+        st.markdown(f"> {hit['snippet']}")
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if offset and st.button("← Previous", key="search_prev"):
+            st.session_state.search_offset = max(0, offset - SEARCH_PAGE_SIZE)
+            st.rerun()
+    with col_page:
+        st.caption(f"Results {offset + 1}–{offset + len(hits)}")
+    with col_next:
+        if has_more and st.button("Next →", key="search_next"):
+            st.session_state.search_offset = offset + SEARCH_PAGE_SIZE
+            st.rerun()
+
+    if source == "Consultations":
+        st.markdown("---")
+        request_ids = list(dict.fromkeys(hit['request_id'] for hit in hits))
+        selected = st.selectbox("View transcript", ["--"] + request_ids, key="search_transcript")
+        if selected != "--":
+            show_chat_history(selected)
 
 
 def show_patient_portal():
@@ -1000,14 +1106,45 @@ def show_patient_portal():
         show_patient_prescriptions()
 
 
+def draw_urgency_banner(urgency, emergency_advice="None"):
+    if urgency == "Emergency":
+        st.error("EMERGENCY DETECTED")
+        if emergency_advice != "None":
+            st.warning(emergency_advice)
+        st.error("Seek immediate medical help.")
+    elif urgency == "High":
+        st.warning("High urgency — consult urgently.")
+    elif urgency == "Moderate":
+        st.info("Moderate — consult soon.")
+    else:
+        st.success("Low urgency.")
+
+
 def show_patient_symptom_checker():
     st.subheader("AI-Powered Symptom Checker (Powered by Google Gemini)")
 
-    if client is None:
+    client = get_client()
+    local_ready = local_triage.ready()
+    if client is None and not local_ready:
         st.error("AI Symptom Checker is currently unavailable — Google API key not configured or invalid.")
-        st.info("Set GOOGLE_API_KEY in your .env file.")
+        st.caption(api_key_problem())
+        st.info("Set GOOGLE_API_KEY in your .env file. Get a free key from: https://aistudio.google.com/app/apikey")
         return
 
+    status = llm_health.status() if client is not None else {"status": "offline"}
+    if status["status"] == "offline":
+        st.info("Gemini is not configured — using the offline triage model.")
+    elif status["status"] == "ok":
+        st.caption("Gemini connected — AI Symptom Checker is ready. 🚀")
+    elif status["status"] == "error":
+        st.warning(f"Gemini connection check failed: {status['detail']}")
+        st.info("""
+Common fixes:
+• Valid API key from https://aistudio.google.com/app/apikey
+• Update packages: pip install --upgrade langchain-google-genai google-generativeai
+• Check quota & billing at Google AI Studio
+        """)
+
     st.info("Describe your symptoms in detail. Gemini will recommend the most suitable medical specialty.")
 
     if "last_recommended_specialty" not in st.session_state:
@@ -1036,51 +1173,64 @@ def show_patient_symptom_checker():
             else:
                 with st.spinner("Analyzing symptoms using Google Gemini..."):
                     try:
-                        messages = [
-                            SystemMessage(content="""
-You are an expert medical triage assistant.
-Analyze symptoms and recommend ONE specialty only.
-Detect emergencies.
-Never diagnose or prescribe.
-
-Respond exactly in this format:
-
-SPECIALTY: [One specialty]
-URGENCY: [Low / Moderate / High / Emergency]
-RECOMMENDATION: [1-2 sentences, simple language]
-EMERGENCY_ADVICE: [Strong warning if needed, else "None"]
-                            """),
-                            HumanMessage(content=f"Symptoms: {sym}")
-                        ]
-
-                        response = client.invoke(messages)
-                        result = response.content
-
-                        if isinstance(result, list):
-                            result = " ".join(
-                                [str(part.get("text", str(part))) for part in result if isinstance(part, dict)])
-                        elif not isinstance(result, str):
-                            result = str(result)
-
-                        result = result.strip()
-
-                        parsed = {
-                            "SPECIALTY": "General Physician",
-                            "URGENCY": "Low",
-                            "RECOMMENDATION": "Please consult a doctor.",
-                            "EMERGENCY_ADVICE": "None"
-                        }
-                        for line in result.split('\n'):
-                            if ':' in line:
-                                k, v = line.split(':', 1)
-                                key = k.strip().upper()
-                                if key in parsed:
-                                    parsed[key] = v.strip()
-
-                        specialty = parsed["SPECIALTY"]
-                        urgency = parsed["URGENCY"]
-                        recommendation = parsed["RECOMMENDATION"]
-                        emergency_advice = parsed["EMERGENCY_ADVICE"]
+                        banner = st.empty()
+                        source = "cache"
+                        triage = triage_cache.get(sym)
+                        local = local_triage.predict(sym) if triage is None else None
+                        if local and local[0]['urgency'] == "Emergency":
+                            with banner.container():
+                                st.markdown("---")
+                                draw_urgency_banner("Emergency", local[0]['emergency_advice'])
+                        if local and (client is None or local_triage.confident(local)):
+                            # Fast path: the local model is sure enough (or is all we have).
+                            source = "local"
+                            triage = local[0]
+                            local_triage.record("fast_path" if client is not None else "fallback")
+                        elif triage is None:
+                            if local:
+                                local_triage.record("escalated")
+                            source = "llm"
+                            # Hand pooled connections back while waiting on Gemini; the
+                            # executor admits more calls than a pool has connections.
+                            release_connections()
+                            messages = [
+                                SystemMessage(content=TRIAGE_PROMPT),
+                                HumanMessage(content=f"Symptoms: {sym}")
+                            ]
+                            found, completed = {}, False
+                            try:
+                                if TRIAGE_STREAMING:
+                                    # Show the urgency the moment its line is complete.
+                                    for field, value in iter_triage_fields(llm_executor.stream(messages)):
+                                        found[field] = value
+                                        if field == "URGENCY":
+                                            with banner.container():
+                                                st.markdown("---")
+                                                draw_urgency_banner(value)
+                                else:
+                                    found = parse_triage(response_text(llm_executor.invoke(messages)).strip())
+                                completed = True
+                            except LLMUnavailable as e:
+                                st.warning(f"AI assistant unavailable right now ({e}).")
+                                if "SPECIALTY" not in found or "URGENCY" not in found:
+                                    found = None
+                            if found is None and local:
+                                source = "local"
+                                triage = local[0]
+                                local_triage.record("fallback")
+                            elif found is None:
+                                source = "fallback"
+                                triage = FALLBACK_TRIAGE
+                            else:
+                                triage = triage_result(found)
+                                # Only a whole reply with every field is worth remembering.
+                                if completed and found.keys() >= TRIAGE_DEFAULTS.keys():
+                                    triage_cache.put(sym, triage)
+
+                        specialty = triage['specialty']
+                        urgency = triage['urgency']
+                        recommendation = triage['recommendation']
+                        emergency_advice = triage['emergency_advice']
 
                         st.session_state.last_recommended_specialty = specialty
 
@@ -1090,24 +1240,18 @@ EMERGENCY_ADVICE: [Strong warning if needed, else "None"]
                             "prediction": specialty,
                             "advice": recommendation,
                             "urgency": urgency,
+                            "source": source,
                             "patient_email": st.session_state.user_profile['email']
                         })
 
-                        st.markdown("---")
-                        if urgency == "Emergency":
-                            st.error("EMERGENCY DETECTED")
-                            if emergency_advice != "None":
-                                st.warning(emergency_advice)
-                            st.error("Seek immediate medical help.")
-                        elif urgency == "High":
-                            st.warning("High urgency — consult urgently.")
-                        elif urgency == "Moderate":
-                            st.info("Moderate — consult soon.")
-                        else:
-                            st.success("Low urgency.")
+                        with banner.container():
+                            st.markdown("---")
+                            draw_urgency_banner(urgency, emergency_advice)
 
                         st.markdown(f"### Recommended Specialty: **{specialty}**")
                         st.info(f"**Why:** {recommendation}")
+                        if source == "local":
+                            st.caption(f"Answered by the offline triage model ({local[1]:.0%} confident).")
 
                         st.caption("This AI analysis is informational only. Always consult a qualified doctor.")
 
@@ -1159,7 +1303,6 @@ def show_request_chat_form():
                 doc_id = doc.split(' (')[1][:-1]
                 d = next(x for x in docs if x['doc_id'] == doc_id)
                 req = {
-                    "request_id": st.session_state.next_request_id,
                     "patient_email": st.session_state.user_profile['email'],
                     "patient_name": st.session_state.user_profile['name'],
                     "patient_id": "P" + st.session_state.user_profile.get('mobile', '')[-6:],
@@ -1174,7 +1317,6 @@ def show_request_chat_form():
                     "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
                 }
                 add_chat_request(req)
-                st.session_state.next_request_id += 1
                 st.success("Request sent!")
                 st.rerun()
 
@@ -1245,47 +1387,129 @@ def generate_prescription_pdf(prescription, patient_name):
     return buffer
 
 
-def show_live_chat_interface():
-    rid = st.session_state.active_chat_request
-    if not rid:
-        st.error("No active chat selected.")
-        return
+CHAT_REFRESH_SECONDS = 3
+CHAT_WINDOW = 50
 
-    req = next((r for r in get_chat_requests() if r.get('request_id') == rid), None)
-    if not req or req.get('status') == 'Closed':
-        st.error("This chat is closed.")
-        st.session_state.active_chat_request = None
+
+def load_chat_transcript(rid):
+    """
+    The newest `window` items of chat `rid`'s merged message/attachment
+    timeline, cached in session state. The database is only queried when the
+    chat's version has moved, and then only for items newer than the ones
+    already held; anything pushed out of the window is dropped.
+    """
+    cache = st.session_state.get('chat_transcript')
+    if not cache or cache['request_id'] != rid:
+        cache = {"request_id": rid, "version": None, "items": [], "window": CHAT_WINDOW, "has_older": False}
+        st.session_state.chat_transcript = cache
+
+    version = chat_version(rid)
+    if cache["version"] == version:
+        return cache["items"]
+    cache["version"] = version
+
+    if cache["items"]:
+        cache["items"].extend(get_chat_timeline(rid, after=timeline_cursor(cache["items"][-1])))
+    else:
+        cache["items"] = get_chat_timeline(rid, limit=cache["window"] + 1)
+    if len(cache["items"]) > cache["window"]:
+        del cache["items"][:-cache["window"]]
+        cache["has_older"] = True
+    return cache["items"]
+
+
+def load_older_chat_items(rid):
+    """Prepend the CHAT_WINDOW items before the oldest one held and widen the window."""
+    cache = st.session_state.chat_transcript
+    before = timeline_cursor(cache["items"][0]) if cache["items"] else None
+    older = get_chat_timeline(rid, limit=CHAT_WINDOW + 1, before=before)
+    cache["has_older"] = len(older) > CHAT_WINDOW
+    cache["items"][:0] = older[-CHAT_WINDOW:]
+    cache["window"] = len(cache["items"])
+
+
+def format_chat_time(item):
+    if not item.get('ts'):
+        return item.get('timestamp', '')
+    sent = datetime.fromtimestamp(item['ts'])
+    return sent.strftime("%H:%M") if sent.date() == datetime.now().date() else sent.strftime("%d %b %H:%M")
+
+
+@st.fragment
+def show_chat_transcript(rid):
+    """
+    The chat pane. Its own buttons and toggles rerun only the pane; new
+    activity from the other side is picked up by watch_chat_transcript().
+    """
+    try:
+        items = load_chat_transcript(rid)
+        if st.session_state.chat_transcript["has_older"] and st.button("Load older messages",
+                                                                        key=f"chat_older_{rid}"):
+            load_older_chat_items(rid)
+    finally:
+        # Fragment-only reruns skip app.py, which normally hands connections back.
+        release_connections()
+
+    render_chat_items(items)
+
+
+@st.fragment(run_every=CHAT_REFRESH_SECONDS)
+def watch_chat_transcript(rid):
+    """
+    Draws nothing. Every CHAT_REFRESH_SECONDS it compares the chat's version
+    with the one the pane last rendered and reruns the page only when it has
+    moved, so a quiet tick touches neither SQLite nor the attachment files.
+    The full rerun also notices a chat that has just been closed.
+    """
+    cache = st.session_state.get('chat_transcript')
+    if cache and cache['request_id'] == rid and cache['version'] != chat_version(rid):
         st.rerun()
-        return
 
-    interlocutor = req.get('doctor_name') if st.session_state.user_profile['role'] == 'patient' else req.get(
-        'patient_name')
-    st.markdown(f"### Chat with **{interlocutor}** (Request ID: {rid})")
 
-    messages = get_chat_messages(rid)
-    attachments = get_chat_attachments(rid)
+def draw_attachment_download(item):
+    """
+    Two-step download: the file is only opened after the user asks for it,
+    so refreshing a transcript never reads the attachments in it.
+    """
+    file_path = item['file_path']
+    filename = item['filename']
+    key = f"attachment_dl_{item['id']}"
+    ready = st.session_state.setdefault("download_ready", set())
 
+    if not os.path.exists(file_path):
+        ready.discard(key)
+        st.caption("File is no longer available.")
+        return
+    if key not in ready and st.button(f"Download {filename}", key=key):
+        ready.add(key)
+    if key in ready:
+        with open(file_path, "rb") as f:
+            data = f.read()
+        st.download_button(f"Save {filename}", data, file_name=filename, key=f"{key}_save",
+                           on_click=ready.discard, args=(key,))
+
+
+def render_chat_items(items):
     st.markdown('<div class="chat-messages">', unsafe_allow_html=True)
 
-    for m in messages:
-        sender_name = m.get('sender', 'Unknown')
+    for item in items:
+        sender_name = item.get('sender', 'Unknown')
         is_user = sender_name == st.session_state.user_profile.get('name')
         cls = "user-message" if is_user else "doctor-message"
-        st.markdown(
-            f'<div class="chat-message {cls}">'
-            f'<div class="message-sender">{sender_name} • {m.get("timestamp", "")}</div>'
-            f'<div>{m.get("text", "")}</div>'
-            f'</div>',
-            unsafe_allow_html=True
-        )
+        timestamp = format_chat_time(item)
 
-    for a in attachments:
-        sender_name = a.get('sender', 'Unknown')
-        is_user = sender_name == st.session_state.user_profile.get('name')
-        cls = "user-message" if is_user else "doctor-message"
-        file_path = a['file_path']
-        filename = a['filename']
-        timestamp = a.get('timestamp', '')
+        if item['kind'] == 'message':
+            st.markdown(
+                f'<div class="chat-message {cls}">'
+                f'<div class="message-sender">{sender_name} • {timestamp}</div>'
+                f'<div>{item.get("text", "")}</div>'
+                f'</div>',
+                unsafe_allow_html=True
+            )
+            continue
+
+        file_path = item['file_path']
+        filename = item['filename']
 
         st.markdown(
             f'<div class="chat-message {cls}">'
@@ -1293,16 +1517,42 @@ def show_live_chat_interface():
             f'<div><strong>Attached:</strong> {filename}</div>',
             unsafe_allow_html=True
         )
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-            st.image(file_path, caption=filename, width=300)
+        if is_image(filename):
+            thumb = thumbnail_path(file_path)
+            if thumb:
+                st.image(thumb, caption=filename)
+            if not os.path.exists(file_path):
+                st.caption("File is no longer available.")
+            elif st.toggle("Show original", key=f"attachment_full_{item['id']}"):
+                st.image(file_path, caption=filename, use_container_width=True)
         else:
-            with open(file_path, "rb") as f:
-                st.download_button(f"Download {filename}", f, file_name=filename)
+            draw_attachment_download(item)
 
         st.markdown('</div>', unsafe_allow_html=True)
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+
+def show_live_chat_interface():
+    rid = st.session_state.active_chat_request
+    if not rid:
+        st.error("No active chat selected.")
+        return
+
+    req = get_chat_request(rid)
+    if not req or req.get('status') == 'Closed':
+        st.error("This chat is closed.")
+        st.session_state.active_chat_request = None
+        st.rerun()
+        return
+
+    interlocutor = req.get('doctor_name') if st.session_state.user_profile['role'] == 'patient' else req.get(
+        'patient_name')
+    st.markdown(f"### Chat with **{interlocutor}** (Request ID: {rid})")
+
+    show_chat_transcript(rid)
+    watch_chat_transcript(rid)
+
     with st.form("chat_form", clear_on_submit=True):
         col_text, col_file = st.columns([4, 1])
         with col_text:
@@ -1326,14 +1576,11 @@ def show_live_chat_interface():
                     st.session_state.last_sent_message = current_message
 
             if uploaded_file:
-                import os
-                os.makedirs("uploads", exist_ok=True)
-                safe_name = f"{rid}_{int(time.time())}_{uploaded_file.name.replace(' ', '_')}"
-                path = os.path.join("uploads", safe_name)
-                with open(path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                path, digest, size = store_attachment(uploaded_file, uploaded_file.name)
+                if is_image(uploaded_file.name):
+                    thumbnail_path(path)
                 add_chat_attachment(rid, uploaded_file.name, path, st.session_state.user_profile['name'],
-                                    st.session_state.user_profile['role'])
+                                    st.session_state.user_profile['role'], sha256=digest, size=size)
 
             if current_message or uploaded_file:
                 st.rerun()
@@ -1379,7 +1626,7 @@ def show_view_users():
         st.info("No patients registered yet.")
         return
 
-    df_original = pd.DataFrame(patients)
+    df_original = pd.DataFrame(as_dicts(patients))
     df_original = df_original.rename(columns={
         'email': 'Email',
         'name': 'Full Name',
@@ -1464,7 +1711,7 @@ def show_view_feedback():
     st.header("User Feedback")
     fb = get_feedback()
     if fb:
-        df = pd.DataFrame(fb)
+        df = pd.DataFrame(as_dicts(fb))
         st.dataframe(df)
     else:
         st.info("No feedback yet.")
@@ -1475,6 +1722,68 @@ def show_assign_chat_form():
     st.info("Manual assignment feature coming soon.")
 
 
+def show_system_health():
+    st.header("System Health")
+
+    st.subheader("Notification Queue")
+    stats = notification_queue_stats()
+    cols = st.columns(4)
+    cols[0].metric("Queue Depth", stats["queue_depth"])
+    cols[1].metric("Written", stats["written"])
+    cols[2].metric("Last Flush (ms)", stats["last_flush_ms"])
+    cols[3].metric("Max Flush (ms)", stats["max_flush_ms"])
+    if stats["failures"]:
+        st.error(f"{stats['failures']} notifications could not be written.")
+
+    st.subheader("Triage Cache")
+    stats = triage_cache.stats()
+    cols = st.columns(5)
+    cols[0].metric("Hit Rate (%)", stats["hit_rate"])
+    cols[1].metric("Memory Hits", stats["memory_hits"])
+    cols[2].metric("DB Hits", stats["db_hits"])
+    cols[3].metric("Misses", stats["misses"])
+    cols[4].metric("Evictions", stats["evictions"])
+    st.caption(f"{stats['memory_entries']} results held in memory.")
+
+    st.subheader("AI Provider")
+    status = llm_health.status()
+    cols = st.columns(3)
+    cols[0].metric("Gemini", status["status"].title())
+    cols[1].metric("Probe Latency (ms)", status["latency_ms"] if status["latency_ms"] is not None else "—")
+    cols[2].metric("Checked", time.strftime("%H:%M:%S", time.localtime(status["checked_at"]))
+                   if status["checked_at"] else "—")
+    if status["status"] in ("error", "unconfigured"):
+        st.error(status["detail"])
+
+    st.subheader("Local Triage Model")
+    stats = local_triage.stats()
+    cols = st.columns(5)
+    cols[0].metric("Status", "Ready" if stats["ready"] else "Not trained")
+    cols[1].metric("Training Rows", stats["rows"])
+    cols[2].metric("Fast Path", stats["fast_path"])
+    cols[3].metric("Escalated", stats["escalated"])
+    cols[4].metric("Fallback", stats["fallback"])
+    if stats["trained_at"]:
+        st.caption(f"Last trained {time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['trained_at']))}"
+                   f"{'' if stats['urgency_ready'] else '; urgency head waiting for data'}.")
+
+    st.subheader("AI Call Executor")
+    stats = llm_executor.stats()
+    cols = st.columns(4)
+    cols[0].metric("Queue Depth", stats["queue_depth"])
+    cols[1].metric("Running", stats["running"])
+    cols[2].metric("Circuit", stats["breaker"].title())
+    cols[3].metric("Rejected", stats["rejected"])
+    cols = st.columns(5)
+    for col, p in zip(cols, ("p50", "p95", "p99")):
+        col.metric(f"{p} (ms)", stats[f"{p}_ms"] if stats[f"{p}_ms"] is not None else "—")
+    cols[3].metric("Calls / Failed", f"{stats['calls']} / {stats['failures']}")
+    cols[4].metric("Retries", stats["retries"])
+
+    if st.button("Refresh"):
+        st.rerun()
+
+
 __all__ = [
     'show_login_page', 'show_patient_portal',
     'show_doctor_portal', 'show_admin_portal'
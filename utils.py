@@ -1,9 +1,8 @@
 import streamlit as st
 import random
 import time
-import bcrypt
 from db import (
-    get_patients_cursor, get_doctors_cursor, commit_patients, commit_doctors,
+    get_patients_cursor, commit_patients, commit_doctors,
     get_chat_requests, add_chat_request, add_submission, add_chat_message
 )
 
@@ -222,7 +221,6 @@ def init_session_state():
         'admin_view': "AddDoctor",
         'portal_view': "Dashboard",
         'next_doc_id': f"{random.randint(200, 999)}",
-        'next_request_id': 10001,
         'active_chat_request': None,
         'verify_email': None,
         'nav_view': "Login"
@@ -231,27 +229,6 @@ def init_session_state():
         if key not in st.session_state:
             st.session_state[key] = value
 
-    # Auto-increment request ID
-    c = get_doctors_cursor()
-    c.execute('SELECT MAX(request_id) FROM chat_requests')
-    max_id = c.fetchone()[0]
-    if max_id:
-        st.session_state.next_request_id = max_id + 1
-
-    # Seed admin only if not exists
-    c.execute('SELECT COUNT(*) FROM doctors WHERE email = ?', ('admin@app.com',))
-    if c.fetchone()[0] == 0:
-        from db import add_doctor
-        add_doctor(
-            email="admin@app.com",
-            password=bcrypt.hashpw("admin".encode(), bcrypt.gensalt()).decode(),
-            name="System Admin",
-            mobile="0000000000",
-            specialty="Admin",
-            doc_id="000",
-            qualification="System"
-        )
-
 # ----------------------------------------------------------------------
 # LOGOUT
 # ----------------------------------------------------------------------